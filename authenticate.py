@@ -21,6 +21,7 @@ class QwenAuth:
     def __init__(self):
         """初始化认证工具."""
         self.auth_manager = QwenAuthManager()
+        self._qr = None  # 复用QRCode实例，避免每次认证重新分配位图
     
     async def authenticate(self, account_id: Optional[str] = None):
         """执行认证流程."""
@@ -46,7 +47,10 @@ class QwenAuth:
             # 显示二维码（使用验证URL）
             if QRCODE_AVAILABLE:
                 try:
-                    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+                    if self._qr is None:
+                        self._qr = qrcode.QRCode(version=1, box_size=4, border=5)
+                    qr = self._qr
+                    qr.clear()
                     qr.add_data(device_flow.verification_uri)
                     qr.make(fit=True)
                     print(f"\n📱 扫描二维码:")
@@ -63,7 +67,9 @@ class QwenAuth:
             credentials = await self.auth_manager.poll_for_token(
                 device_flow.device_code,
                 device_flow.code_verifier,
-                account_id
+                account_id,
+                interval=device_flow.interval,
+                expires_in=device_flow.expires_in
             )
             
             if account_id:
@@ -135,8 +141,8 @@ class QwenAuth:
                 print(f"❌ 账户 '{account_id}' 不存在")
                 sys.exit(1)
             
-            # 确认删除
-            confirm = input(f"确定要删除账户 '{account_id}'? (y/N): ")
+            # 确认删除（在线程中等待输入，避免阻塞事件循环）
+            confirm = await asyncio.to_thread(input, f"确定要删除账户 '{account_id}'? (y/N): ")
             if confirm.lower() not in ['y', 'yes']:
                 print("❌ 操作已取消")
                 return
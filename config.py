@@ -1,56 +1,89 @@
 """Configuration module for Qwen OpenAI Proxy."""
 
 import os
+from dataclasses import dataclass
 from typing import Optional
-from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # 加载环境变量
 load_dotenv()
 
+# 在导入时一次性读取所有环境变量，避免热路径上重复的os.getenv调用
+_env = {
+    'QWEN_CLIENT_ID': os.getenv('QWEN_CLIENT_ID', 'f0304373b74a44d2b584a3fb70ca9e56'),
+    'QWEN_CLIENT_SECRET': os.getenv('QWEN_CLIENT_SECRET', ''),
+    'QWEN_BASE_URL': os.getenv('QWEN_BASE_URL', 'https://chat.qwen.ai'),
+    'QWEN_DEVICE_CODE_ENDPOINT': os.getenv('QWEN_DEVICE_CODE_ENDPOINT', 'https://chat.qwen.ai/api/v1/oauth2/device/code'),
+    'QWEN_TOKEN_ENDPOINT': os.getenv('QWEN_TOKEN_ENDPOINT', 'https://chat.qwen.ai/api/v1/oauth2/token'),
+    'QWEN_SCOPE': os.getenv('QWEN_SCOPE', 'openid profile email model.completion'),
+    'PORT': os.getenv('PORT', '8080'),
+    'HOST': os.getenv('HOST', 'localhost'),
+    'WORKERS': os.getenv('WORKERS', '1'),
+    'STREAM': os.getenv('STREAM', 'false'),
+    'DEFAULT_MODEL': os.getenv('DEFAULT_MODEL', 'qwen3-coder-plus'),
+    'TOKEN_REFRESH_BUFFER': os.getenv('TOKEN_REFRESH_BUFFER', '30000'),
+    'DEBUG_LOG': os.getenv('DEBUG_LOG', 'false'),
+    'LOG_FILE_LIMIT': os.getenv('LOG_FILE_LIMIT', '20'),
+    'LOG_MAX_BYTES': os.getenv('LOG_MAX_BYTES', '4194304'),
+    'API_TIMEOUT': os.getenv('API_TIMEOUT', '300'),
+    'MAX_CONCURRENT_UPSTREAM': os.getenv('MAX_CONCURRENT_UPSTREAM', '32'),
+    'API_KEY': os.getenv('API_KEY'),
+}
 
-class QwenConfig(BaseModel):
+
+@dataclass(frozen=True, slots=True)
+class QwenConfig:
     """Qwen OAuth configuration."""
-    client_id: str = os.getenv('QWEN_CLIENT_ID', 'f0304373b74a44d2b584a3fb70ca9e56')
-    client_secret: str = os.getenv('QWEN_CLIENT_SECRET', '')
-    base_url: str = os.getenv('QWEN_BASE_URL', 'https://chat.qwen.ai')
-    device_code_endpoint: str = os.getenv('QWEN_DEVICE_CODE_ENDPOINT', 'https://chat.qwen.ai/api/v1/oauth2/device/code')
-    token_endpoint: str = os.getenv('QWEN_TOKEN_ENDPOINT', 'https://chat.qwen.ai/api/v1/oauth2/token')
-    scope: str = os.getenv('QWEN_SCOPE', 'openid profile email model.completion')
+    client_id: str = _env['QWEN_CLIENT_ID']
+    client_secret: str = _env['QWEN_CLIENT_SECRET']
+    base_url: str = _env['QWEN_BASE_URL']
+    device_code_endpoint: str = _env['QWEN_DEVICE_CODE_ENDPOINT']
+    token_endpoint: str = _env['QWEN_TOKEN_ENDPOINT']
+    scope: str = _env['QWEN_SCOPE']
 
 
-class Config(BaseModel):
+@dataclass(frozen=True, slots=True)
+class Config:
     """应用程序配置."""
-    
+
     # 服务器配置
-    port: int = int(os.getenv('PORT', '8080'))
-    host: str = os.getenv('HOST', 'localhost')
-    
+    port: int = int(_env['PORT'])
+    host: str = _env['HOST']
+
+    # 工作进程数（>1时请求计数按进程独立维护）
+    workers: int = int(_env['WORKERS'])
+
     # 流式配置
-    stream: bool = os.getenv('STREAM', 'false').lower() == 'true'
-    
+    stream: bool = _env['STREAM'].lower() == 'true'
+
     # Qwen配置
     qwen: QwenConfig = QwenConfig()
-    
+
     # 默认模型
-    default_model: str = os.getenv('DEFAULT_MODEL', 'qwen3-coder-plus')
-    
-    # Token刷新缓冲时间（毫秒）
-    token_refresh_buffer: int = int(os.getenv('TOKEN_REFRESH_BUFFER', '30000'))
-    
-    # 调试日志配置
-    debug_log: bool = os.getenv('DEBUG_LOG', 'false').lower() == 'true'
-    log_file_limit: int = int(os.getenv('LOG_FILE_LIMIT', '20'))
-    
+    default_model: str = _env['DEFAULT_MODEL']
+
+    # Token刷新缓冲时间（毫秒），以及预计算的秒数（避免每次使用时换算）
+    token_refresh_buffer: int = int(_env['TOKEN_REFRESH_BUFFER'])
+    token_refresh_buffer_seconds: float = int(_env['TOKEN_REFRESH_BUFFER']) / 1000
+
+    # 调试日志配置：log_file_limit为保留的轮转文件数，
+    # log_max_bytes为单个日志文件的轮转阈值
+    debug_log: bool = _env['DEBUG_LOG'].lower() == 'true'
+    log_file_limit: int = int(_env['LOG_FILE_LIMIT'])
+    log_max_bytes: int = int(_env['LOG_MAX_BYTES'])
+
     # API超时时间（秒）
-    api_timeout: int = int(os.getenv('API_TIMEOUT', '300'))  # 5分钟
-    
+    api_timeout: int = int(_env['API_TIMEOUT'])  # 5分钟
+
+    # 上游并发请求上限（平滑突发负载，减少429风暴）
+    max_concurrent_upstream: int = int(_env['MAX_CONCURRENT_UPSTREAM'])
+
     # 默认API端点
     default_api_base_url: str = 'https://dashscope.aliyuncs.com/compatible-mode/v1'
-    
+
     # API认证配置
-    api_key: Optional[str] = os.getenv('API_KEY')  # 用于保护代理服务器的API Key
+    api_key: Optional[str] = _env['API_KEY']  # 用于保护代理服务器的API Key
 
 
-# 创建全局配置实例
-config = Config()
\ No newline at end of file
+# 创建全局配置实例（仅构造一次）
+config = Config()
@@ -1,56 +1,89 @@
 """Qwen OpenAI代理服务器主入口."""
 
 import asyncio
+import hmac
 import logging
 from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Union, Dict, Any
 
+import orjson
 import uvicorn
-from fastapi import FastAPI, HTTPException, Request, Depends, status
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+from pydantic import ValidationError
+
 from models import (
+    CHAT_COMPLETION_REQUEST_ADAPTER,
+    EMBEDDING_REQUEST_ADAPTER,
     ChatCompletionRequest,
     EmbeddingRequest,
     ErrorResponse,
     ErrorDetail
 )
-from qwen.api import QwenAPI
-from qwen.auth import QwenAuthManager
-from utils.logger import DebugLogger
+from qwen.api import QWEN_MODELS_BYTES, QWEN_MODELS_DICT, QwenAPI
+from qwen.client import close_client
+from utils.logger import CYAN, RESET, YELLOW, DebugLogger, setup_queue_logging
 from utils.token_counter import count_tokens
 from config import config
 
 
-# 设置日志
-logging.basicConfig(level=logging.INFO)
+# 设置日志（队列化，格式化和I/O在后台线程完成）
+log_listener = setup_queue_logging(level=logging.INFO)
 logger = logging.getLogger(__name__)
+log = logging.getLogger("qwen.proxy")
+
+# 流式块合并阈值
+STREAM_FLUSH_BYTES = 16 * 1024  # 缓冲达到16KB立即发送
+STREAM_FLUSH_INTERVAL = 0.01  # 距上次发送超过10ms立即发送
+
+# 预编码的SSE帧定界符
+SSE_DATA_PREFIX = b'data: '
+SSE_FRAME_SUFFIX = b'\n\n'
 
 # 认证配置
 security = HTTPBearer(auto_error=False)
 
-# 全局实例
+# 全局实例（auth_manager统一由qwen_api持有，避免双份凭据状态）
 qwen_api = QwenAPI()
-auth_manager = QwenAuthManager()
 debug_logger = DebugLogger()
 
 
+# 在模块加载时读取一次API Key，避免每个请求的属性遍历
+# 直接绑定各请求模型的Rust SchemaSerializer：跳过model_dump()
+# 每次调用的kwargs重检与属性查找（仅调试日志路径使用）
+_CHAT_REQUEST_SERIALIZER = ChatCompletionRequest.__pydantic_serializer__
+_EMBEDDING_REQUEST_SERIALIZER = EmbeddingRequest.__pydantic_serializer__
+
+_API_KEY = config.api_key
+# compare_digest对含非ASCII字符的str会抛TypeError（header可携带任意
+# latin-1字节），统一按字节比较；surrogateescape保证任意token可编码
+_API_KEY_BYTES = _API_KEY.encode('utf-8') if _API_KEY else b''
+
+
+@lru_cache(maxsize=1024)
+def _is_valid_api_key(token: str) -> bool:
+    """检查提交的token是否与配置的API Key匹配（结果缓存）."""
+    return hmac.compare_digest(
+        token.encode('utf-8', 'surrogateescape'), _API_KEY_BYTES
+    )
+
+
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """验证Authorization header中的token."""
-    # 如果没有配置API Key，则跳过认证
-    if not config.api_key:
-        logger.warning("未配置API_KEY环境变量，认证功能已禁用")
+    # 如果没有配置API Key，则跳过认证（启动时已发出警告）
+    if not _API_KEY:
         return None
-        
+
     if credentials is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="需要提供API Key",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if credentials.credentials != config.api_key:
+    if not _is_valid_api_key(credentials.credentials):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="无效的API Key",
@@ -66,7 +99,10 @@ async def lifespan(app: FastAPI):
     logger.info(f"Qwen OpenAI代理服务器启动于 http://{config.host}:{config.port}")
     logger.info(f"OpenAI兼容端点: http://{config.host}:{config.port}/v1")
     logger.info(f"认证端点: http://{config.host}:{config.port}/auth/initiate")
-    
+
+    if not _API_KEY:
+        logger.warning("未配置API_KEY环境变量，认证功能已禁用")
+
     # 显示可用账户
     try:
         await qwen_api.auth_manager.load_all_accounts()
@@ -76,7 +112,7 @@ async def lifespan(app: FastAPI):
         print(f'\n🔍 调试信息: 检测到 {len(account_ids)} 个账户: {account_ids}')
         
         if account_ids:
-            print('\n\033[36m可用账户:\033[0m')
+            print('\n' + CYAN + '可用账户:' + RESET)
             for account_id in account_ids:
                 credentials = qwen_api.auth_manager.get_account_credentials(account_id)
                 is_valid = credentials and qwen_api.auth_manager.is_token_valid(credentials)
@@ -88,15 +124,51 @@ async def lifespan(app: FastAPI):
             if default_credentials:
                 is_valid = qwen_api.auth_manager.is_token_valid(default_credentials)
                 status = '✅ 有效' if is_valid else '❌ 无效/已过期'
-                print(f'\n\033[36m默认账户: {status}\033[0m')
+                print('\n' + CYAN + f'默认账户: {status}' + RESET)
             else:
-                print('\n\033[36m未配置账户。请先进行认证。\033[0m')
+                print('\n' + CYAN + '未配置账户。请先进行认证。' + RESET)
     except Exception as error:
-        print('\n\033[33m警告: 无法加载账户信息\033[0m')
-    
+        print('\n' + YELLOW + '警告: 无法加载账户信息' + RESET)
+
+    # 启动时并发预热所有过期账户的token，首批请求不再逐个踩同步刷新
+    try:
+        await qwen_api.auth_manager.warmup_accounts()
+    except Exception as error:
+        logger.warning(f"启动token预热失败: {error}")
+
+    # 后台主动刷新token，避免请求路径上的同步刷新往返
+    async def _refresh_loop():
+        interval = max(config.token_refresh_buffer_seconds / 2, 1.0)  # 缓冲时间的一半（秒）
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                account_ids = qwen_api.auth_manager.get_account_ids()
+                if account_ids:
+                    for account_id in account_ids:
+                        await qwen_api.auth_manager.refresh_if_needed(account_id)
+                else:
+                    await qwen_api.auth_manager.refresh_if_needed()
+            except Exception as error:
+                logger.warning(f"后台token刷新失败: {error}")
+
+    refresh_task = asyncio.create_task(_refresh_loop())
+
+    # 请求计数的周期落盘：把每请求一次的全文件重写合并为每5秒最多一次
+    async def _counts_flush_loop():
+        while True:
+            await asyncio.sleep(5)
+            await qwen_api.auth_manager.flush_request_counts()
+
+    counts_flush_task = asyncio.create_task(_counts_flush_loop())
+
     yield
-    
+
     # 关闭时
+    refresh_task.cancel()
+    counts_flush_task.cancel()
+    # 把尚未落盘的计数刷写出去，避免丢失关闭前的增量
+    await qwen_api.auth_manager.flush_request_counts()
+    await close_client()
     logger.info("Qwen OpenAI代理服务器关闭")
 
 
@@ -105,30 +177,48 @@ app = FastAPI(
     title="Qwen OpenAI代理",
     description="通过OpenAI兼容API公开Qwen模型的代理服务器",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
-# 添加CORS中间件
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# 轻量CORS处理：健康检查直通，其他路径仅在请求带Origin时写入CORS头，
+# 避免CORSMiddleware对每个请求（包括高频负载均衡探活）的解析开销
+CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+    "Access-Control-Allow-Methods": "*",
+    "Access-Control-Allow-Headers": "*",
+}
+
+
+@app.middleware("http")
+async def cors_middleware(request: Request, call_next):
+    """按需添加CORS头的中间件."""
+    if request.url.path == "/health":
+        return await call_next(request)
+
+    origin = request.headers.get("origin")
+
+    # 预检请求直接应答，无需进入路由
+    if origin and request.method == "OPTIONS":
+        return Response(status_code=204, headers=CORS_HEADERS)
+
+    response = await call_next(request)
+    if origin:
+        response.headers.update(CORS_HEADERS)
+    return response
 
 
 class QwenOpenAIProxy:
     """Qwen OpenAI代理类."""
     
-    async def handle_chat_completion(self, request: ChatCompletionRequest, raw_request: Request) -> Union[JSONResponse, StreamingResponse]:
+    async def handle_chat_completion(self, request: ChatCompletionRequest, raw_request: Request) -> Union[ORJSONResponse, StreamingResponse]:
         """处理聊天完成请求."""
         try:
             # 计算请求中的token数量
             token_count = count_tokens(request.messages)
             
             # 在终端显示token数量
-            print(f'\033[36m收到聊天完成请求，包含 {token_count} 个token\033[0m')
+            log.info(f'收到聊天完成请求，包含 {token_count} 个token')
             
             # 检查是否请求流式且已启用
             is_streaming = request.stream and config.stream
@@ -143,18 +233,18 @@ class QwenOpenAIProxy:
                 
         except Exception as error:
             # 记录API调用及错误
-            request_data = await self._serialize_request(raw_request, request.model_dump())
+            request_data = await self._serialize_request(raw_request, _CHAT_REQUEST_SERIALIZER.to_python(request, mode='json', exclude_none=True))
             debug_filename = await debug_logger.log_api_call('/v1/chat/completions', request_data, None, error)
             
             # 以红色打印错误消息
             if debug_filename:
-                print(f'\033[31m处理聊天完成请求时出错。调试日志保存到: {debug_filename}\033[0m')
+                log.error(f'处理聊天完成请求时出错。调试日志保存到: {debug_filename}')
             else:
-                print('\033[31m处理聊天完成请求时出错。\033[0m')
+                log.error('处理聊天完成请求时出错。')
             
             # 处理认证错误
             if 'Not authenticated' in str(error) or 'access token' in str(error):
-                return JSONResponse(
+                return ORJSONResponse(
                     status_code=401,
                     content={
                         "error": {
@@ -164,7 +254,7 @@ class QwenOpenAIProxy:
                     }
                 )
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "error": {
@@ -174,14 +264,16 @@ class QwenOpenAIProxy:
                 }
             )
     
-    async def handle_regular_chat_completion(self, request: ChatCompletionRequest, raw_request: Request) -> JSONResponse:
+    async def handle_regular_chat_completion(self, request: ChatCompletionRequest, raw_request: Request) -> Response:
         """处理常规聊天完成."""
         try:
-            # 通过我们集成的客户端调用Qwen API
-            response = await qwen_api.chat_completions(request)
+            # 通过我们集成的客户端调用Qwen API（返回上游原始字节）
+            response_bytes = await qwen_api.chat_completions(request)
+            # 仅为usage统计与调试日志解析一次；响应本身按原字节转发
+            response = orjson.loads(response_bytes)
             
             # 记录API调用
-            request_data = await self._serialize_request(raw_request, request.model_dump())
+            request_data = await self._serialize_request(raw_request, _CHAT_REQUEST_SERIALIZER.to_python(request, mode='json', exclude_none=True))
             debug_filename = await debug_logger.log_api_call('/v1/chat/completions', request_data, response)
             
             # 如果响应中有使用数据，显示token使用情况
@@ -195,11 +287,12 @@ class QwenOpenAIProxy:
             
             # 以绿色打印成功消息和调试文件信息
             if debug_filename:
-                print(f'\033[32m聊天完成请求处理成功{token_info}。调试日志保存到: {debug_filename}\033[0m')
+                log.info(f'聊天完成请求处理成功{token_info}。调试日志保存到: {debug_filename}')
             else:
-                print(f'\033[32m聊天完成请求处理成功{token_info}。\033[0m')
+                log.info(f'聊天完成请求处理成功{token_info}。')
             
-            return JSONResponse(content=response)
+            # 原样转发上游字节，跳过FastAPI的再序列化
+            return Response(content=response_bytes, media_type="application/json")
             
         except Exception as error:
             raise error  # 重新抛出以由主处理器处理
@@ -208,22 +301,63 @@ class QwenOpenAIProxy:
         """处理流式聊天完成."""
         try:
             # 记录API调用（没有响应数据，因为它是流式的）
-            request_data = await self._serialize_request(raw_request, request.model_dump())
+            request_data = await self._serialize_request(raw_request, _CHAT_REQUEST_SERIALIZER.to_python(request, mode='json', exclude_none=True))
             debug_filename = await debug_logger.log_api_call('/v1/chat/completions', request_data, {"streaming": True})
             
             # 打印流式请求消息
-            print(f'\033[32m流式聊天完成请求开始。调试日志保存到: {debug_filename}\033[0m')
+            log.info(f'流式聊天完成请求开始。调试日志保存到: {debug_filename}')
             
             # 调用Qwen API流式方法
             stream_generator = qwen_api.stream_chat_completions(request)
             
             async def generate():
+                # 合并相邻的小块再yield，减少ASGI send调用和TCP写入次数；
+                # 缓冲达到大小阈值立即发送；时间阈值由等待下一块的超时
+                # 主动驱动——上游停顿时已缓冲的字节也会在间隔内发出。
+                # 用asyncio.wait而非wait_for：超时不会取消底层__anext__，
+                # 同一个任务在下一轮继续等待
+                buf = bytearray()
+                loop = asyncio.get_running_loop()
+                stream = stream_generator.__aiter__()
+                next_task = None
+                deadline = 0.0
                 try:
-                    async for chunk in stream_generator:
-                        yield chunk
+                    while True:
+                        if next_task is None:
+                            next_task = asyncio.ensure_future(stream.__anext__())
+                        timeout = max(0.0, deadline - loop.time()) if buf else None
+                        done, _ = await asyncio.wait({next_task}, timeout=timeout)
+                        if not done:
+                            # 到达flush时限：发出已缓冲数据，继续等同一块
+                            yield bytes(buf)
+                            buf.clear()
+                            continue
+                        task, next_task = next_task, None
+                        try:
+                            chunk = task.result()
+                        except StopAsyncIteration:
+                            break
+                        if isinstance(chunk, str):
+                            chunk = chunk.encode('utf-8')
+                        if not buf:
+                            deadline = loop.time() + STREAM_FLUSH_INTERVAL
+                        buf += chunk
+                        if len(buf) >= STREAM_FLUSH_BYTES:
+                            yield bytes(buf)
+                            buf.clear()
+                    if buf:
+                        yield bytes(buf)
                 except Exception as error:
-                    print(f'\033[31m流式聊天完成出错: {str(error)}\033[0m')
-                    yield f'data: {{"error": {{"message": "{str(error)}", "type": "streaming_error"}}}}\n\n'
+                    if buf:
+                        yield bytes(buf)
+                    log.error(f'流式聊天完成出错: {str(error)}')
+                    # orjson保证错误消息被正确转义，输出bytes避免额外编码
+                    yield SSE_DATA_PREFIX + orjson.dumps(
+                        {"error": {"message": str(error), "type": "streaming_error"}}
+                    ) + SSE_FRAME_SUFFIX
+                finally:
+                    if next_task is not None:
+                        next_task.cancel()
             
             return StreamingResponse(
                 generate(),
@@ -238,42 +372,38 @@ class QwenOpenAIProxy:
         except Exception as error:
             raise error  # 重新抛出以由主处理器处理
     
-    async def handle_models(self, raw_request: Request) -> JSONResponse:
+    async def handle_models(self, raw_request: Request) -> Response:
         """处理模型列表请求."""
         try:
             # 在终端显示请求
-            print('\033[36m收到模型请求\033[0m')
-            
-            # 从Qwen获取模型
-            models = await qwen_api.list_models()
-            models_dict = models.model_dump()
+            log.info('收到模型请求')
             
-            # 记录API调用
-            request_data = await self._serialize_request(raw_request)
-            debug_filename = await debug_logger.log_api_call('/v1/models', request_data, models_dict)
+            # 模型列表是静态的：直接返回导入时预编码的字节，零序列化开销
+            request_data = self._serialize_request_no_body(raw_request)
+            debug_filename = await debug_logger.log_api_call('/v1/models', request_data, QWEN_MODELS_DICT)
             
             # 以绿色打印成功消息和调试文件信息
             if debug_filename:
-                print(f'\033[32m模型请求处理成功。调试日志保存到: {debug_filename}\033[0m')
+                log.info(f'模型请求处理成功。调试日志保存到: {debug_filename}')
             else:
-                print('\033[32m模型请求处理成功。\033[0m')
+                log.info('模型请求处理成功。')
             
-            return JSONResponse(content=models_dict)
+            return Response(content=QWEN_MODELS_BYTES, media_type="application/json")
             
         except Exception as error:
             # 记录API调用及错误
-            request_data = await self._serialize_request(raw_request)
+            request_data = self._serialize_request_no_body(raw_request)
             debug_filename = await debug_logger.log_api_call('/v1/models', request_data, None, error)
             
             # 以红色打印错误消息
             if debug_filename:
-                print(f'\033[31m获取模型时出错。调试日志保存到: {debug_filename}\033[0m')
+                log.error(f'获取模型时出错。调试日志保存到: {debug_filename}')
             else:
-                print('\033[31m获取模型时出错。\033[0m')
+                log.error('获取模型时出错。')
             
             # 处理认证错误
             if 'Not authenticated' in str(error) or 'access token' in str(error):
-                return JSONResponse(
+                return ORJSONResponse(
                     status_code=401,
                     content={
                         "error": {
@@ -283,7 +413,7 @@ class QwenOpenAIProxy:
                     }
                 )
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "error": {
@@ -293,23 +423,25 @@ class QwenOpenAIProxy:
                 }
             )
     
-    async def handle_embeddings(self, request: EmbeddingRequest, raw_request: Request) -> JSONResponse:
+    async def handle_embeddings(self, request: EmbeddingRequest, raw_request: Request) -> Response:
         """处理嵌入向量请求."""
         try:
-            # 计算请求中的token数量
-            if isinstance(request.input, list):
-                token_count = sum(count_tokens(text) for text in request.input)
-            else:
-                token_count = count_tokens(request.input)
-            
+            # 在线程中计算token数量，与上游API调用重叠进行
+            token_count_task = asyncio.create_task(
+                asyncio.to_thread(self._count_embedding_tokens, request.input)
+            )
+
+            # 调用Qwen嵌入向量API（返回上游原始字节）
+            embeddings_bytes = await qwen_api.create_embeddings(request)
+            # 仅为usage统计与调试日志解析一次；响应本身按原字节转发
+            embeddings = orjson.loads(embeddings_bytes)
+
             # 在终端显示token数量
-            print(f'\033[36m收到嵌入向量请求，包含 {token_count} 个token\033[0m')
-            
-            # 调用Qwen嵌入向量API
-            embeddings = await qwen_api.create_embeddings(request)
+            token_count = await token_count_task
+            log.info(f'收到嵌入向量请求，包含 {token_count} 个token')
             
             # 记录API调用
-            request_data = await self._serialize_request(raw_request, request.model_dump())
+            request_data = await self._serialize_request(raw_request, _EMBEDDING_REQUEST_SERIALIZER.to_python(request, mode='json', exclude_none=True))
             debug_filename = await debug_logger.log_api_call('/v1/embeddings', request_data, embeddings)
             
             # 如果响应中有使用数据，显示token使用情况
@@ -322,23 +454,24 @@ class QwenOpenAIProxy:
             
             # 以绿色打印成功消息和调试文件信息
             if debug_filename:
-                print(f'\033[32m嵌入向量请求处理成功{token_info}。调试日志保存到: {debug_filename}\033[0m')
+                log.info(f'嵌入向量请求处理成功{token_info}。调试日志保存到: {debug_filename}')
             else:
-                print(f'\033[32m嵌入向量请求处理成功{token_info}。\033[0m')
+                log.info(f'嵌入向量请求处理成功{token_info}。')
             
-            return JSONResponse(content=embeddings)
+            # 原样转发上游字节，跳过FastAPI的再序列化
+            return Response(content=embeddings_bytes, media_type="application/json")
             
         except Exception as error:
             # 记录API调用及错误
-            request_data = await self._serialize_request(raw_request, request.model_dump())
+            request_data = await self._serialize_request(raw_request, _EMBEDDING_REQUEST_SERIALIZER.to_python(request, mode='json', exclude_none=True))
             await debug_logger.log_api_call('/v1/embeddings', request_data, None, error)
             
             # 以红色打印错误消息
-            print(f'\033[31m处理嵌入向量请求时出错: {str(error)}\033[0m')
+            log.error(f'处理嵌入向量请求时出错: {str(error)}')
             
             # 处理认证错误
             if 'Not authenticated' in str(error) or 'access token' in str(error):
-                return JSONResponse(
+                return ORJSONResponse(
                     status_code=401,
                     content={
                         "error": {
@@ -348,7 +481,7 @@ class QwenOpenAIProxy:
                     }
                 )
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "error": {
@@ -358,11 +491,11 @@ class QwenOpenAIProxy:
                 }
             )
     
-    async def handle_auth_initiate(self, raw_request: Request) -> JSONResponse:
+    async def handle_auth_initiate(self, raw_request: Request) -> ORJSONResponse:
         """处理认证启动请求."""
         try:
             # 启动设备流程
-            device_flow = await auth_manager.initiate_device_flow()
+            device_flow = await qwen_api.auth_manager.initiate_device_flow()
             
             response = {
                 "verification_uri": device_flow.verification_uri,
@@ -372,26 +505,26 @@ class QwenOpenAIProxy:
             }
             
             # 记录API调用
-            request_data = await self._serialize_request(raw_request)
+            request_data = self._serialize_request_no_body(raw_request)
             debug_filename = await debug_logger.log_api_call('/auth/initiate', request_data, response)
             
             # 以绿色打印成功消息和调试文件信息
             if debug_filename:
-                print(f'\033[32m认证启动请求处理成功。调试日志保存到: {debug_filename}\033[0m')
+                log.info(f'认证启动请求处理成功。调试日志保存到: {debug_filename}')
             else:
-                print('\033[32m认证启动请求处理成功。\033[0m')
+                log.info('认证启动请求处理成功。')
             
-            return JSONResponse(content=response)
+            return ORJSONResponse(content=response)
             
         except Exception as error:
             # 记录API调用及错误
-            request_data = await self._serialize_request(raw_request)
+            request_data = self._serialize_request_no_body(raw_request)
             await debug_logger.log_api_call('/auth/initiate', request_data, None, error)
             
             # 以红色打印错误消息
-            print(f'\033[31m启动认证时出错: {str(error)}\033[0m')
+            log.error(f'启动认证时出错: {str(error)}')
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "error": {
@@ -401,7 +534,7 @@ class QwenOpenAIProxy:
                 }
             )
     
-    async def handle_auth_poll(self, poll_data: Dict[str, Any], raw_request: Request) -> JSONResponse:
+    async def handle_auth_poll(self, poll_data: Dict[str, Any], raw_request: Request) -> ORJSONResponse:
         """处理认证轮询请求."""
         try:
             device_code = poll_data.get('device_code')
@@ -420,12 +553,12 @@ class QwenOpenAIProxy:
                 await debug_logger.log_api_call('/auth/poll', request_data, None, Exception('缺少device_code或code_verifier'))
                 
                 # 以红色打印错误消息
-                print('\033[31m认证轮询错误: 缺少device_code或code_verifier\033[0m')
+                log.error('认证轮询错误: 缺少device_code或code_verifier')
                 
-                return JSONResponse(status_code=400, content=error_response)
+                return ORJSONResponse(status_code=400, content=error_response)
             
             # 轮询token
-            credentials = await auth_manager.poll_for_token(device_code, code_verifier)
+            credentials = await qwen_api.auth_manager.poll_for_token(device_code, code_verifier)
             
             response = {
                 "access_token": credentials.access_token,
@@ -438,11 +571,11 @@ class QwenOpenAIProxy:
             
             # 以绿色打印成功消息和调试文件信息
             if debug_filename:
-                print(f'\033[32m认证轮询请求处理成功。调试日志保存到: {debug_filename}\033[0m')
+                log.info(f'认证轮询请求处理成功。调试日志保存到: {debug_filename}')
             else:
-                print('\033[32m认证轮询请求处理成功。\033[0m')
+                log.info('认证轮询请求处理成功。')
             
-            return JSONResponse(content=response)
+            return ORJSONResponse(content=response)
             
         except Exception as error:
             # 记录API调用及错误
@@ -450,9 +583,9 @@ class QwenOpenAIProxy:
             await debug_logger.log_api_call('/auth/poll', request_data, None, error)
             
             # 以红色打印错误消息
-            print(f'\033[31m轮询token时出错: {str(error)}\033[0m')
+            log.error(f'轮询token时出错: {str(error)}')
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={
                     "error": {
@@ -462,15 +595,35 @@ class QwenOpenAIProxy:
                 }
             )
     
-    async def _serialize_request(self, raw_request: Request, body_data: Dict[str, Any] = None) -> Dict[str, Any]:
-        """序列化请求数据以用于日志记录."""
+    @staticmethod
+    def _count_embedding_tokens(input_data: Union[str, list]) -> int:
+        """计算嵌入向量输入的token数量."""
+        if isinstance(input_data, list):
+            return sum(count_tokens(text) for text in input_data)
+        return count_tokens(input_data)
+
+    def _serialize_request_no_body(self, raw_request: Request) -> Dict[str, Any]:
+        """序列化无请求体端点（GET /v1/models、POST /auth/initiate）的请求数据."""
+        if not debug_logger.enabled:
+            return None
+
+        return {
+            "method": raw_request.method,
+            "url": str(raw_request.url),
+            "headers": dict(raw_request.headers),
+            "body": {}
+        }
+
+    async def _serialize_request(self, raw_request: Request, body_data: Dict[str, Any]) -> Dict[str, Any]:
+        """序列化请求数据以用于日志记录.
+
+        body_data必须由调用方传入（FastAPI已解析过请求体，重新读取会导致二次解析）。
+        """
+        # 调试日志禁用时，log_api_call是空操作，无需构建headers字典
+        if not debug_logger.enabled:
+            return None
+
         try:
-            if body_data is None:
-                try:
-                    body_data = await raw_request.json()
-                except:
-                    body_data = {}
-            
             return {
                 "method": raw_request.method,
                 "url": str(raw_request.url),
@@ -490,10 +643,32 @@ class QwenOpenAIProxy:
 proxy = QwenOpenAIProxy()
 
 
+def _validate_body(adapter, body: bytes):
+    """用预构建的TypeAdapter从原始字节验证请求体.
+
+    验证失败时返回OpenAI风格的422错误响应。
+    """
+    try:
+        return adapter.validate_json(body)
+    except ValidationError as error:
+        return ORJSONResponse(
+            status_code=422,
+            content={
+                "error": {
+                    "message": str(error),
+                    "type": "invalid_request_error"
+                }
+            }
+        )
+
+
 # 路由定义
 @app.post("/v1/chat/completions")
-async def chat_completions(request: ChatCompletionRequest, raw_request: Request, token: str = Depends(verify_token)):
+async def chat_completions(raw_request: Request, token: str = Depends(verify_token)):
     """聊天完成端点."""
+    request = _validate_body(CHAT_COMPLETION_REQUEST_ADAPTER, await raw_request.body())
+    if isinstance(request, ORJSONResponse):
+        return request
     return await proxy.handle_chat_completion(request, raw_request)
 
 
@@ -504,8 +679,11 @@ async def list_models(raw_request: Request, token: str = Depends(verify_token)):
 
 
 @app.post("/v1/embeddings")
-async def create_embeddings(request: EmbeddingRequest, raw_request: Request, token: str = Depends(verify_token)):
+async def create_embeddings(raw_request: Request, token: str = Depends(verify_token)):
     """嵌入向量端点."""
+    request = _validate_body(EMBEDDING_REQUEST_ADAPTER, await raw_request.body())
+    if isinstance(request, ORJSONResponse):
+        return request
     return await proxy.handle_embeddings(request, raw_request)
 
 
@@ -532,6 +710,9 @@ if __name__ == "__main__":
         "main:app",
         host=config.host,
         port=config.port,
+        loop="uvloop",
+        http="httptools",
+        workers=config.workers,
         reload=False,
         access_log=False
     )
\ No newline at end of file
@@ -1,38 +1,84 @@
 """数据模型定义."""
 
-from typing import List, Optional, Any, Dict, Union
-from pydantic import BaseModel, Field
-from datetime import datetime
+from dataclasses import dataclass
+from typing import List, Literal, Optional, Any, TypedDict, Union
+import sys
+import time
+
+import msgspec
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, field_validator
+
+
+# 允许的消息role取值，以及对应的驻留字符串池（每个role全程共享一个实例）
+_ROLE_INTERN = {r: sys.intern(r) for r in ("system", "user", "assistant", "tool", "function")}
+_ALLOWED_ROLES = frozenset(_ROLE_INTERN)
 
 
 class Message(BaseModel):
     """聊天消息模型."""
+    model_config = ConfigDict(extra='ignore', frozen=True, populate_by_name=True)
+
     role: str
     content: str
     name: Optional[str] = None
 
+    @field_validator('role', mode='before')
+    @classmethod
+    def _intern_role(cls, v):
+        return _ROLE_INTERN.get(v, v)
+
 
 class ChatCompletionRequest(BaseModel):
-    """聊天完成请求模型."""
+    """聊天完成请求模型.
+
+    messages保持为字典列表：消息原样转发给上游，逐条构建Message
+    模型只会在转发开始前增加与历史长度成正比的纯延迟，
+    这里只做轻量的role/content形状检查。
+    """
+    model_config = ConfigDict(extra='ignore', frozen=True, populate_by_name=True)
+
     model: str = "qwen3-coder-plus"
-    messages: List[Message]
+    messages: List[dict]
     temperature: Optional[float] = None
     max_tokens: Optional[int] = None
     top_p: Optional[float] = None
-    tools: Optional[List[Dict[str, Any]]] = None
-    tool_choice: Optional[Union[str, Dict[str, Any]]] = None
+    tools: Optional[List[dict]] = None
+    # Any：取值原样转发给上游，不为str/dict联合构建union验证器
+    tool_choice: Any = None
     stream: Optional[bool] = False
-    stream_options: Optional[Dict[str, Any]] = None
+    stream_options: Optional[dict] = None
+
+    @field_validator('messages')
+    @classmethod
+    def _check_messages(cls, v: List[dict]) -> List[dict]:
+        for msg in v:
+            if msg.get('role') not in _ALLOWED_ROLES:
+                raise ValueError(f"无效的消息role: {msg.get('role')!r}")
+            if not isinstance(msg.get('content'), str):
+                raise ValueError("消息content必须为字符串")
+            # 长对话里每条消息的role都是全新分配的str；换成驻留实例后
+            # 同一role全程共享一个对象，下游dict查找可走指针比较捷径
+            msg['role'] = _ROLE_INTERN[msg['role']]
+        return v
 
 
 class EmbeddingRequest(BaseModel):
     """嵌入向量请求模型."""
+    model_config = ConfigDict(extra='ignore', frozen=True, populate_by_name=True)
+
     model: str = "text-embedding-v1"
-    input: Union[str, List[str]]
+    # left_to_right：按声明顺序取第一个匹配分支，跳过smart-union对两个分支的
+    # 逐一尝试与评分（输入形状由JSON token类型直接决定，无歧义）
+    input: Union[str, List[str]] = Field(union_mode='left_to_right')
+
 
+class QwenCredentials(msgspec.Struct, frozen=True):
+    """Qwen认证凭据模型.
 
-class QwenCredentials(BaseModel):
-    """Qwen认证凭据模型."""
+    msgspec.Struct：凭据在每次上游调用前都要加载/校验，
+    msgspec直接从JSON解码到C布局结构体，跳过pydantic的
+    dict中间产物与逐字段验证路径（未知键默认忽略）。
+    """
     access_token: str
     refresh_token: Optional[str] = None
     token_type: str = "Bearer"
@@ -42,6 +88,8 @@ class QwenCredentials(BaseModel):
 
 class DeviceFlowResponse(BaseModel):
     """设备授权流程响应模型."""
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     device_code: str
     user_code: str
     verification_uri: str
@@ -50,91 +98,140 @@ class DeviceFlowResponse(BaseModel):
     code_verifier: str
 
 
-class TokenResponse(BaseModel):
+class TokenResponse(msgspec.Struct, frozen=True):
     """Token响应模型."""
     access_token: str
+    expires_in: int
     refresh_token: Optional[str] = None
     token_type: str = "Bearer"
-    expires_in: int
     resource_url: Optional[str] = None
 
 
-class Usage(BaseModel):
-    """Token使用统计模型."""
+@dataclass(slots=True, frozen=True)
+class Usage:
+    """Token使用统计模型.
+
+    响应侧dataclass：pydantic原生支持stdlib dataclass字段，
+    三个int不再走BaseModel的构建路径，orjson也可直接序列化。
+    """
     prompt_tokens: int = 0
     completion_tokens: int = 0
     total_tokens: int = 0
 
 
-class ChatChoice(BaseModel):
-    """聊天选择模型."""
+class ChatChoice(TypedDict, total=False):
+    """聊天选择（响应侧TypedDict，不做嵌套模型验证）."""
     index: int
-    message: Message
-    finish_reason: Optional[str] = None
+    message: dict
+    finish_reason: Optional[str]
 
 
 class ChatCompletionResponse(BaseModel):
-    """聊天完成响应模型."""
+    """聊天完成响应模型.
+
+    choices保持为字典列表：响应数据来自上游，已是目标形状，
+    嵌套BaseModel验证只会增加每行的构建成本。
+    """
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     id: str
-    object: str = "chat.completion"
-    created: int = Field(default_factory=lambda: int(datetime.now().timestamp()))
+    object: Literal["chat.completion"] = "chat.completion"
+    created: int = Field(default_factory=lambda: int(time.time()))
     model: str
-    choices: List[ChatChoice]
+    choices: List[dict]
     usage: Optional[Usage] = None
 
 
-class StreamChoice(BaseModel):
-    """流式聊天选择模型."""
+class StreamChoice(TypedDict, total=False):
+    """流式聊天选择（响应侧TypedDict，不做嵌套模型验证）."""
     index: int
-    delta: Dict[str, Any]
-    finish_reason: Optional[str] = None
+    delta: dict
+    finish_reason: Optional[str]
 
 
 class ChatCompletionStreamResponse(BaseModel):
-    """流式聊天完成响应模型."""
+    """流式聊天完成响应模型.
+
+    仅作为接口形状的文档保留：流式路径直接透传上游SSE字节
+    （错误帧用orjson.dumps构造），每个token块不会实例化本模型，
+    也不经过pydantic序列化。
+    """
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     id: str
-    object: str = "chat.completion.chunk"
-    created: int = Field(default_factory=lambda: int(datetime.now().timestamp()))
+    object: Literal["chat.completion.chunk"] = "chat.completion.chunk"
+    created: int = Field(default_factory=lambda: int(time.time()))
     model: str
-    choices: List[StreamChoice]
+    choices: List[dict]
     usage: Optional[Usage] = None
 
 
-class EmbeddingData(BaseModel):
-    """嵌入向量数据模型."""
-    object: str = "embedding"
-    embedding: List[float]
+@dataclass(slots=True)
+class EmbeddingData:
+    """嵌入向量数据模型.
+
+    响应侧不需要验证：使用普通dataclass跳过pydantic对每行
+    嵌入向量的遍历，embedding原样保存上游返回的数值序列。
+    """
+    embedding: Any
     index: int
+    object: Literal["embedding"] = "embedding"
 
 
-class EmbeddingResponse(BaseModel):
-    """嵌入向量响应模型."""
-    object: str = "list"
+@dataclass(slots=True)
+class EmbeddingResponse:
+    """嵌入向量响应模型（响应侧dataclass，orjson可直接序列化）."""
     data: List[EmbeddingData]
     model: str
+    object: Literal["list"] = "list"
     usage: Optional[Usage] = None
 
 
 class ModelData(BaseModel):
     """模型数据模型."""
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     id: str
-    object: str = "model"
+    object: Literal["model"] = "model"
     created: int = 1754686206
-    owned_by: str = "qwen"
+    owned_by: Literal["qwen"] = "qwen"
 
 
 class ModelsResponse(BaseModel):
     """模型列表响应模型."""
-    object: str = "list"
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
+    object: Literal["list"] = "list"
     data: List[ModelData]
 
 
 class ErrorDetail(BaseModel):
     """错误详情模型."""
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
     message: str
     type: str
 
 
 class ErrorResponse(BaseModel):
     """错误响应模型."""
-    error: ErrorDetail
\ No newline at end of file
+    model_config = ConfigDict(extra='ignore', frozen=True)
+
+    error: ErrorDetail
+
+
+# 在导入时强制构建所有模型的核心schema，确保__pydantic_validator__/
+# __pydantic_serializer__在首个请求到达前已物化并全进程共享
+for _model in (
+    Message, ChatCompletionRequest, EmbeddingRequest, DeviceFlowResponse,
+    ChatCompletionResponse, ChatCompletionStreamResponse,
+    ModelData, ModelsResponse, ErrorDetail, ErrorResponse,
+):
+    _model.model_rebuild(force=True)
+del _model
+
+
+# 预构建的TypeAdapter：复用已编译的SchemaValidator，避免每个请求重建验证上下文；
+# validate_json直接从字节验证，跳过中间Python dict
+CHAT_COMPLETION_REQUEST_ADAPTER = TypeAdapter(ChatCompletionRequest)
+EMBEDDING_REQUEST_ADAPTER = TypeAdapter(EmbeddingRequest)
\ No newline at end of file
@@ -1,27 +1,32 @@
 """Qwen API客户端."""
 
-import json
+import logging
+import re
+import time
 import asyncio
+from functools import lru_cache
+
+import orjson
 from typing import Optional, Dict, Any, AsyncGenerator
-from datetime import datetime
+from datetime import datetime, timedelta
 
-import httpx
 from fastapi import HTTPException
-from fastapi.responses import StreamingResponse
 
 from models import (
-    ChatCompletionRequest, 
+    ChatCompletionRequest,
     EmbeddingRequest,
-    ChatCompletionResponse,
-    EmbeddingResponse,
     ModelsResponse,
     ModelData,
     QwenCredentials
 )
 from qwen.auth import QwenAuthManager
+from qwen.client import get_client
 from config import config
 
 
+log = logging.getLogger(__name__)
+
+
 # 已知的Qwen模型
 QWEN_MODELS = [
     ModelData(id='qwen3-coder-plus', object='model', created=1754686206, owned_by='qwen'),
@@ -30,565 +35,497 @@ QWEN_MODELS = [
     ModelData(id='qwen3-turbo', object='model', created=1754686206, owned_by='qwen')
 ]
 
+# 模型列表完全静态：在导入时构建并序列化一次，
+# list_models返回共享实例，/v1/models直接返回预编码字节
+_MODELS_RESPONSE = ModelsResponse(object="list", data=QWEN_MODELS)
+QWEN_MODELS_DICT = _MODELS_RESPONSE.model_dump()
+QWEN_MODELS_BYTES = orjson.dumps(QWEN_MODELS_DICT)
+
+
+# 认证/配额相关的HTTP状态码，以及无响应对象时回退用的预编译关键词模式
+_AUTH_STATUS_CODES = frozenset({400, 401, 403, 504})
+_QUOTA_STATUS_CODES = frozenset({429})
+_AUTH_KEYWORDS_RE = re.compile(
+    r'unauthorized|forbidden|invalid (?:api key|access token)|token expired|'
+    r'authentication|access denied|504|gateway timeout',
+    re.IGNORECASE,
+)
+_QUOTA_KEYWORDS_RE = re.compile(
+    r'insufficient_quota|free allocated quota exceeded|quota exceeded',
+    re.IGNORECASE,
+)
+
 
 def is_auth_error(error: Exception) -> bool:
-    """检查错误是否与认证/授权相关."""
+    """检查错误是否与认证/授权相关.
+
+    状态码是权威判断依据，优先短路返回；只有异常未附带响应对象时
+    才回退到消息匹配，避免对携带大响应体的异常做str()全量拷贝。
+    """
     if not error:
         return False
-    
-    error_message = str(error).lower()
-    
-    # 检查HTTP状态码
-    if hasattr(error, 'response') and hasattr(error.response, 'status_code'):
-        status_code = error.response.status_code
-        if status_code in [400, 401, 403, 504]:
-            return True
-    
-    # 检查错误消息
-    auth_keywords = [
-        'unauthorized', 'forbidden', 'invalid api key', 'invalid access token',
-        'token expired', 'authentication', 'access denied', '504', 'gateway timeout'
-    ]
-    
-    return any(keyword in error_message for keyword in auth_keywords)
+
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is not None:
+        return status_code in _AUTH_STATUS_CODES
+
+    return _AUTH_KEYWORDS_RE.search(str(error)) is not None
 
 
 def is_quota_exceeded_error(error: Exception) -> bool:
     """检查错误是否与配额限制相关."""
     if not error:
         return False
-    
-    error_message = str(error).lower()
-    
-    # 检查HTTP状态码
-    if hasattr(error, 'response') and hasattr(error.response, 'status_code'):
-        status_code = error.response.status_code
-        if status_code == 429:
-            return True
-    
-    # 检查错误消息
-    quota_keywords = [
-        'insufficient_quota', 'free allocated quota exceeded', 'quota exceeded'
-    ]
-    
-    return any(keyword in error_message for keyword in quota_keywords)
+
+    response = getattr(error, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if status_code is not None:
+        return status_code in _QUOTA_STATUS_CODES
+
+    return _QUOTA_KEYWORDS_RE.search(str(error)) is not None
+
+
+def _next_midnight_ts() -> float:
+    """返回下一个本地午夜的时间戳（配额按日重置）."""
+    now = datetime.now()
+    midnight = datetime(now.year, now.month, now.day) + timedelta(days=1)
+    return midnight.timestamp()
+
+
+@lru_cache(maxsize=32)
+def _resolve_endpoint(resource_url: Optional[str]) -> str:
+    """将凭据的resource_url归一化为完整API端点.
+
+    端点对同一resource_url是稳定的，缓存后热路径上的
+    startswith/endswith字符串检查退化为一次dict查找。
+    """
+    if not resource_url:
+        # 使用默认端点
+        return config.default_api_base_url
+    endpoint = resource_url
+    # 确保它有scheme
+    if not endpoint.startswith('http'):
+        endpoint = f"https://{endpoint}"
+    # 确保它有/v1后缀
+    if not endpoint.endswith('/v1'):
+        if endpoint.endswith('/'):
+            endpoint += 'v1'
+        else:
+            endpoint += '/v1'
+    return endpoint
+
+
+# 流式请求在共享payload之上叠加的固定键值
+_STREAM_PAYLOAD_EXTRA = {
+    'stream': True,  # 启用流式
+    'stream_options': {'include_usage': True}  # 在最终块中包含使用数据
+}
 
 
 class QwenAPI:
     """Qwen API客户端."""
-    
+
+    # 请求头的静态部分：每次请求只需拼入Authorization（流式再加Accept）
+    _BASE_HEADERS = {
+        'Content-Type': 'application/json',
+        'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)',
+    }
+
     def __init__(self):
         """初始化API客户端."""
         self.auth_manager = QwenAuthManager()
-    
-    async def get_api_endpoint(self, credentials: Optional[QwenCredentials]) -> str:
-        """获取API端点."""
-        if credentials and credentials.resource_url:
-            endpoint = credentials.resource_url
-            # 确保它有scheme
-            if not endpoint.startswith('http'):
-                endpoint = f"https://{endpoint}"
-            # 确保它有/v1后缀
-            if not endpoint.endswith('/v1'):
-                if endpoint.endswith('/'):
-                    endpoint += 'v1'
-                else:
-                    endpoint += '/v1'
-            return endpoint
+        # 限制同时在途的上游请求数：突发时平滑负载，避免429风暴
+        # 触发昂贵的逐账户轮换路径
+        self._upstream_sem = asyncio.Semaphore(config.max_concurrent_upstream)
+        # 访问token的时间界限缓存：account_id -> (token, 过期时间戳秒)，
+        # 临近过期前跳过get_valid_access_token的锁与凭据加载往返
+        self._token_cache: Dict[Optional[str], tuple] = {}
+        # 轮询游标：相邻请求从不同账户起步，分散配额消耗
+        self._rr_index = 0
+        # 今日配额已耗尽的账户 -> 失效时间戳（下一个午夜），
+        # 选择账户时直接跳过，省去注定429的完整往返
+        self._exhausted: Dict[str, float] = {}
+
+    def get_api_endpoint(self, credentials: Optional[QwenCredentials]) -> str:
+        """获取API端点（按resource_url缓存归一化结果）."""
+        return _resolve_endpoint(credentials.resource_url if credentials else None)
+
+    async def _get_access_token(self, account_id: Optional[str] = None) -> str:
+        """获取访问token，距过期超过30秒时直接复用缓存."""
+        cached = self._token_cache.get(account_id)
+        if cached is not None and cached[1] - time.time() > 30:
+            return cached[0]
+
+        token = await self.auth_manager.get_valid_access_token(account_id)
+
+        # 从凭据的expiry_date（毫秒）推导缓存有效期
+        if account_id:
+            credentials = self.auth_manager.get_account_credentials(account_id)
         else:
-            # 使用默认端点
-            return config.default_api_base_url
-    
-    async def chat_completions(self, request: ChatCompletionRequest) -> Dict[str, Any]:
-        """聊天完成API调用."""
-        # 加载所有账户以支持多账户
+            credentials = await self.auth_manager.load_credentials()
+        if credentials and credentials.expiry_date:
+            self._token_cache[account_id] = (token, credentials.expiry_date / 1000)
+        return token
+
+    def _build_headers(self, access_token: str, stream: bool = False) -> Dict[str, str]:
+        """构建请求头：静态部分复用，仅拼接Authorization."""
+        headers = dict(self._BASE_HEADERS)
+        headers['Authorization'] = f'Bearer {access_token}'
+        if stream:
+            headers['Accept'] = 'text/event-stream'
+        return headers
+
+    @staticmethod
+    def _translate_error(error: Exception, context: str = '') -> HTTPException:
+        """将上游异常翻译为HTTPException."""
+        suffix = f'（{context}）' if context else ''
+        if hasattr(error, 'response'):
+            # 请求已发出，服务器返回状态码
+            try:
+                error_data = orjson.loads(error.response.content)
+            except Exception:
+                error_data = str(error.response.text)
+            return HTTPException(
+                status_code=error.response.status_code,
+                detail=f"Qwen API错误{suffix}: {error.response.status_code} {error_data}"
+            )
+        # 请求发出但未收到响应，或设置请求时发生错误
+        return HTTPException(status_code=500, detail=f"Qwen API请求失败{suffix}: {str(error)}")
+
+    async def _attempt(self, url: str, body: bytes, access_token: str) -> bytes:
+        """单次非流式上游调用.
+
+        共享客户端与预编码的body字节，首次尝试与token刷新重试
+        之间只有Authorization不同，调用方只需换token再调一次。
+        """
+        client = get_client()
+        async with self._upstream_sem:
+            response = await client.post(url, content=body, headers=self._build_headers(access_token))
+        response.raise_for_status()
+        return response.content
+
+    async def _refresh_default_token(self, credentials: Optional[QwenCredentials]) -> str:
+        """强制刷新默认账户token（先失效本层缓存），返回新token."""
+        self._token_cache.pop(None, None)
+        await self.auth_manager.perform_token_refresh(credentials)
+        return await self.auth_manager.get_valid_access_token()
+
+    async def _request(self, path: str, payload: Dict[str, Any]) -> bytes:
+        """统一的非流式上游请求，返回上游响应的原始字节.
+
+        拥有账户轮换（粘性直到配额错误）、请求计数与错误翻译，
+        所有公开方法只负责构建payload后委托到这里。返回字节而非
+        解析后的dict，响应可以原样转发给客户端而不经过二次序列化。
+        """
         await self.auth_manager.load_all_accounts()
         account_ids = self.auth_manager.get_account_ids()
-        
+
         # 如果没有额外账户，使用默认行为
         if not account_ids:
-            return await self.chat_completions_single_account(request)
-        
-        # 简单轮询：每个请求只使用一个账户
-        account_info = await self.auth_manager.get_next_account()
-        if not account_info:
-            raise Exception("没有可用账户")
-        
-        account_id = account_info["accountId"]
-        credentials = account_info["credentials"]
-        
-        if not credentials:
-            raise Exception(f"账户 {account_id} 凭据无效")
-        
-        try:
-            # 显示正在使用的账户
-            request_count = self.auth_manager.get_request_count(account_id) + 1
-            print(f'\033[36m使用账户 {account_id} (今日第 #{request_count} 次请求)\033[0m')
-            
-            # 获取此账户的有效访问token
-            access_token = await self.auth_manager.get_valid_access_token(account_id)
-            
-            # 获取API端点
-            api_endpoint = await self.get_api_endpoint(credentials)
-            
-            # 进行API调用
-            url = f"{api_endpoint}/chat/completions"
-            payload = {
-                'model': request.model or config.default_model,
-                'messages': [msg.model_dump() for msg in request.messages],
-                'temperature': request.temperature,
-                'max_tokens': request.max_tokens,
-                'top_p': request.top_p,
-                'tools': request.tools,
-                'tool_choice': request.tool_choice
-            }
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}',
-                'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)'
-            }
-            
-            # 增加此账户的请求计数
-            await self.auth_manager.increment_request_count(account_id)
-            updated_count = self.auth_manager.get_request_count(account_id)
-            print(f'\033[36m使用账户 {account_id} (今日第 #{updated_count} 次请求)\033[0m')
-            
-            async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-                return response.json()
-                
-        except Exception as error:
-            # 简单错误处理：直接抛出错误，让下一个请求使用下一个账户
-            if hasattr(error, 'response'):
-                error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
-                raise HTTPException(
-                    status_code=error.response.status_code,
-                    detail=f"Qwen API错误: {error.response.status_code} {error_data}"
-                )
-            else:
-                raise HTTPException(status_code=500, detail=f"Qwen API请求失败: {str(error)}")
-    
-    async def chat_completions_single_account(self, request: ChatCompletionRequest) -> Dict[str, Any]:
-        """单账户聊天完成API调用."""
+            return await self._request_default(path, payload)
+
+        # 请求体在轮换间不变：只编码一次，重试/轮换直接复用字节
+        body = orjson.dumps(payload)
+
+        # 从上次使用账户的下一个开始轮询，而不是每次都先打第一个账户，
+        # 避免account[0]先被打爆配额再逐个顺延的429连锁
+        current_account_index = self._rr_index % len(account_ids)
+        self._rr_index = (current_account_index + 1) % len(account_ids)
+        last_error = None
+
+        for _ in range(len(account_ids)):
+            # 获取当前账户（粘性直到配额错误）
+            account_id = account_ids[current_account_index]
+            credentials = self.auth_manager.get_account_credentials(account_id)
+
+            if not credentials or self._exhausted.get(account_id, 0) > time.time():
+                # 如果当前账户无效或今日配额已耗尽，移动到下一个账户
+                current_account_index = (current_account_index + 1) % len(account_ids)
+                continue
+
+            try:
+                # 获取此账户的有效访问token和API端点
+                access_token = await self._get_access_token(account_id)
+                api_endpoint = self.get_api_endpoint(credentials)
+                url = api_endpoint + path
+
+                # 增加此账户的请求计数，只在增加后记录一次使用日志
+                await self.auth_manager.increment_request_count(account_id)
+                updated_count = self.auth_manager.get_request_count(account_id)
+                log.info(f'使用账户 {account_id} (今日第 #{updated_count} 次请求)')
+
+                # 上游响应字节原样透传，不做解析或形状验证（schema由上游
+                # 保证；需要读取usage等字段的调用方自行orjson.loads）
+                return await self._attempt(url, body, access_token)
+
+            except Exception as error:
+                last_error = error
+
+                # 检查是否为配额超出错误
+                if is_quota_exceeded_error(error):
+                    log.warning(f'账户 {account_id} 配额已超出 (第 #{self.auth_manager.get_request_count(account_id)} 次请求)，轮换到下一个账户...')
+                    # 当日内跳过此账户，避免后续请求重复打到已耗尽的配额
+                    self._exhausted[account_id] = _next_midnight_ts()
+                    # 移动到下一个账户用于下次请求
+                    current_account_index = (current_account_index + 1) % len(account_ids)
+                    next_account_id = account_ids[current_account_index]
+                    log.warning(f'将尝试下一个账户 {next_account_id}')
+                    continue
+
+                # 其他错误直接抛出，让下一个请求使用下一个账户
+                raise self._translate_error(error)
+
+        # 如果到达这里，所有账户都失败了
+        raise HTTPException(status_code=500, detail=f"所有账户都失败了。最后错误: {str(last_error)}")
+
+    async def _request_default(self, path: str, payload: Dict[str, Any]) -> bytes:
+        """默认账户（无多账户配置）请求，认证错误时刷新token并重试一次."""
         # 获取有效的访问token（需要时自动刷新）
-        access_token = await self.auth_manager.get_valid_access_token()
+        access_token = await self._get_access_token()
         credentials = await self.auth_manager.load_credentials()
-        api_endpoint = await self.get_api_endpoint(credentials)
-        
+        api_endpoint = self.get_api_endpoint(credentials)
+        url = api_endpoint + path
+
         # 显示请求计数（使用default作为账户ID）
         account_id = "default"
         current_count = self.auth_manager.get_request_count(account_id) + 1
-        print(f'\033[36m使用默认账户 (今日第 #{current_count} 次请求)\033[0m')
-        
-        # 进行API调用
-        url = f"{api_endpoint}/chat/completions"
-        payload = {
-            'model': request.model or config.default_model,
-            'messages': [msg.model_dump() for msg in request.messages],
-            'temperature': request.temperature,
-            'max_tokens': request.max_tokens,
-            'top_p': request.top_p,
-            'tools': request.tools,
-            'tool_choice': request.tool_choice
-        }
-        
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}',
-            'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)'
-        }
-        
+        log.info(f'使用默认账户 (今日第 #{current_count} 次请求)')
+
+        # 请求体只编码一次，token刷新重试时复用
+        body = orjson.dumps(payload)
+
         try:
             # 增加请求计数
             await self.auth_manager.increment_request_count(account_id)
-            updated_count = self.auth_manager.get_request_count(account_id)
-            print(f'\033[36m使用默认账户 (今日第 #{updated_count} 次请求)\033[0m')
-            
-            async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                response = await client.post(url, json=payload, headers=headers)
-                response.raise_for_status()
-                return response.json()
-                
+
+            return await self._attempt(url, body, access_token)
+
         except Exception as error:
             # 检查是否为可能受益于重试的认证错误
             if is_auth_error(error):
-                print(f'\033[33m检测到认证错误 ({getattr(error.response, "status_code", "N/A") if hasattr(error, "response") else "N/A"})，尝试刷新token并重试...\033[0m')
+                log.warning(f'检测到认证错误 ({getattr(error.response, "status_code", "N/A") if hasattr(error, "response") else "N/A"})，尝试刷新token并重试...')
                 try:
-                    # 强制刷新token并重试一次
-                    await self.auth_manager.perform_token_refresh(credentials)
-                    new_access_token = await self.auth_manager.get_valid_access_token()
-                    
-                    # 使用新token重试请求
-                    print('\033[36m使用刷新后的token重试请求...\033[0m')
-                    retry_headers = {
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {new_access_token}',
-                        'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)'
-                    }
-                    
-                    async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                        retry_response = await client.post(url, json=payload, headers=retry_headers)
-                        retry_response.raise_for_status()
-                        print('\033[32m刷新token后请求成功\033[0m')
-                        return retry_response.json()
-                        
-                except Exception as retry_error:
-                    print('\033[31m即使刷新token后请求仍然失败\033[0m')
+                    # 强制刷新token并用新Authorization重试一次
+                    new_access_token = await self._refresh_default_token(credentials)
+                    log.info('使用刷新后的token重试请求...')
+                    content = await self._attempt(url, body, new_access_token)
+                    log.info('刷新token后请求成功')
+                    return content
+
+                except Exception:
+                    log.error('即使刷新token后请求仍然失败')
                     # 如果重试失败，抛出带有额外上下文的原始错误
                     if hasattr(error, 'response'):
-                        error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
-                        raise HTTPException(
-                            status_code=error.response.status_code,
-                            detail=f"Qwen API错误（刷新token尝试后）: {error.response.status_code} {error_data}"
-                        )
-            
-            if hasattr(error, 'response'):
-                # 请求已发出，服务器返回状态码
-                error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
-                raise HTTPException(
-                    status_code=error.response.status_code,
-                    detail=f"Qwen API错误: {error.response.status_code} {error_data}"
-                )
-            else:
-                # 请求发出但未收到响应，或设置请求时发生错误
-                raise HTTPException(status_code=500, detail=f"Qwen API请求失败: {str(error)}")
-    
-    async def list_models(self) -> ModelsResponse:
-        """列出模型."""
-        print("返回模拟模型列表")
-        
-        # 返回Qwen模型的模拟列表，因为Qwen API没有此端点
-        return ModelsResponse(
-            object="list",
-            data=QWEN_MODELS
-        )
-    
-    async def create_embeddings(self, request: EmbeddingRequest) -> Dict[str, Any]:
-        """创建嵌入向量."""
-        # 加载所有账户以支持多账户
+                        raise self._translate_error(error, '刷新token尝试后')
+
+            raise self._translate_error(error)
+
+    async def _stream_request(self, path: str, payload: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+        """统一的流式上游请求，账户处理结构与_request一致."""
         await self.auth_manager.load_all_accounts()
         account_ids = self.auth_manager.get_account_ids()
-        
+
         # 如果没有额外账户，使用默认行为
         if not account_ids:
-            # 获取有效的访问token（需要时自动刷新）
-            access_token = await self.auth_manager.get_valid_access_token()
-            credentials = await self.auth_manager.load_credentials()
-            api_endpoint = await self.get_api_endpoint(credentials)
-            
-            # 进行API调用
-            url = f"{api_endpoint}/embeddings"
-            payload = {
-                'model': request.model or 'text-embedding-v1',
-                'input': request.input
-            }
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}',
-                'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)'
-            }
-            
+            async for chunk in self._stream_request_default(path, payload):
+                yield chunk
+            return
+
+        # 请求体在轮换间不变：只编码一次，重试/轮换直接复用字节
+        body = orjson.dumps(payload)
+
+        # 从上次使用账户的下一个开始轮询，而不是每次都先打第一个账户，
+        # 避免account[0]先被打爆配额再逐个顺延的429连锁
+        current_account_index = self._rr_index % len(account_ids)
+        self._rr_index = (current_account_index + 1) % len(account_ids)
+        last_error = None
+
+        for _ in range(len(account_ids)):
+            # 获取当前账户（粘性直到配额错误）
+            account_id = account_ids[current_account_index]
+            credentials = self.auth_manager.get_account_credentials(account_id)
+
+            if not credentials or self._exhausted.get(account_id, 0) > time.time():
+                # 如果当前账户无效或今日配额已耗尽，移动到下一个账户
+                current_account_index = (current_account_index + 1) % len(account_ids)
+                continue
+
             try:
-                async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                    response = await client.post(url, json=payload, headers=headers)
-                    response.raise_for_status()
-                    return response.json()
-                    
+                # 显示正在使用的账户
+                request_count = self.auth_manager.get_request_count(account_id) + 1
+                log.info(f'使用账户 {account_id} (今日第 #{request_count} 次请求)')
+
+                # 获取此账户的有效访问token和API端点
+                access_token = await self._get_access_token(account_id)
+                api_endpoint = self.get_api_endpoint(credentials)
+                url = api_endpoint + path
+
+                # 增加此账户的请求计数
+                await self.auth_manager.increment_request_count(account_id)
+
+                client = get_client()
+                async with self._upstream_sem:
+                    async with client.stream('POST', url, content=body, headers=self._build_headers(access_token, stream=True)) as response:
+                        response.raise_for_status()
+
+                        # aiter_bytes跳过UTF-8解码但保留内容解压：上游若启用
+                        # gzip，原始字节直接转发会让客户端收到无解压头的压缩流
+                        async for chunk in response.aiter_bytes():
+                            yield chunk
+
+                return  # 成功完成，退出循环
+
             except Exception as error:
-                # 检查是否为可能受益于重试的认证错误
-                if is_auth_error(error):
-                    print(f'\033[33m检测到认证错误 ({getattr(error.response, "status_code", "N/A") if hasattr(error, "response") else "N/A"})，尝试刷新token并重试...\033[0m')
-                    try:
-                        # 强制刷新token并重试一次
-                        await self.auth_manager.perform_token_refresh(credentials)
-                        new_access_token = await self.auth_manager.get_valid_access_token()
-                        
-                        # 使用新token重试请求
-                        print('\033[36m使用刷新后的token重试请求...\033[0m')
-                        retry_headers = {
-                            'Content-Type': 'application/json',
-                            'Authorization': f'Bearer {new_access_token}',
-                            'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)'
-                        }
-                        
-                        async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                            retry_response = await client.post(url, json=payload, headers=retry_headers)
-                            retry_response.raise_for_status()
-                            print('\033[32m刷新token后请求成功\033[0m')
-                            return retry_response.json()
-                            
-                    except Exception as retry_error:
-                        print('\033[31m即使刷新token后请求仍然失败\033[0m')
-                        # 如果重试失败，抛出带有额外上下文的原始错误
-                        if hasattr(error, 'response'):
-                            error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
-                            raise HTTPException(
-                                status_code=error.response.status_code,
-                                detail=f"Qwen API错误（刷新token尝试后）: {error.response.status_code} {error_data}"
-                            )
-                
-                if hasattr(error, 'response'):
-                    # 请求已发出，服务器返回状态码
-                    error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
-                    raise HTTPException(
-                        status_code=error.response.status_code,
-                        detail=f"Qwen API错误: {error.response.status_code} {error_data}"
-                    )
-                else:
-                    # 请求发出但未收到响应，或设置请求时发生错误
-                    raise HTTPException(status_code=500, detail=f"Qwen API请求失败: {str(error)}")
-        else:
-            # 多账户逻辑与chat_completions类似
-            # 从第一个账户开始（粘性选择）
-            current_account_index = 0
-            last_error = None
-            max_retries = len(account_ids)
-            
-            for i in range(max_retries):
+                last_error = error
+
+                # 检查是否为配额超出错误
+                if is_quota_exceeded_error(error):
+                    log.warning(f'账户 {account_id} 配额已超出 (第 #{self.auth_manager.get_request_count(account_id)} 次请求)，轮换到下一个账户...')
+                    # 当日内跳过此账户，避免后续请求重复打到已耗尽的配额
+                    self._exhausted[account_id] = _next_midnight_ts()
+                    # 移动到下一个账户用于下次请求
+                    current_account_index = (current_account_index + 1) % len(account_ids)
+                    next_account_id = account_ids[current_account_index]
+                    log.warning(f'将尝试下一个账户 {next_account_id}')
+                    continue
+
+                raise self._translate_error(error)
+
+        # 如果到达这里，所有账户都失败了
+        raise HTTPException(status_code=500, detail=f"所有账户都失败了。最后错误: {str(last_error)}")
+
+    async def _stream_request_default(self, path: str, payload: Dict[str, Any]) -> AsyncGenerator[bytes, None]:
+        """默认账户流式请求，认证错误时刷新token并重试一次."""
+        # 获取有效的访问token（需要时自动刷新）
+        access_token = await self._get_access_token()
+        credentials = await self.auth_manager.load_credentials()
+        api_endpoint = self.get_api_endpoint(credentials)
+        url = api_endpoint + path
+
+        # 请求体只编码一次，token刷新重试时复用
+        body = orjson.dumps(payload)
+
+        try:
+            client = get_client()
+            async with self._upstream_sem:
+                async with client.stream('POST', url, content=body, headers=self._build_headers(access_token, stream=True)) as response:
+                    response.raise_for_status()
+
+                    async for chunk in response.aiter_bytes():
+                        yield chunk
+
+        except Exception as error:
+            # 检查是否为可能受益于重试的认证错误
+            if is_auth_error(error):
+                log.warning(f'检测到认证错误 ({getattr(error.response, "status_code", "N/A") if hasattr(error, "response") else "N/A"})，尝试刷新token并重试...')
                 try:
-                    # 获取当前账户（粘性直到配额错误）
-                    account_id = account_ids[current_account_index]
-                    credentials = self.auth_manager.get_account_credentials(account_id)
-                    
-                    if not credentials:
-                        # 如果当前账户无效，移动到下一个账户
-                        current_account_index = (current_account_index + 1) % len(account_ids)
-                        continue
-                    
-                    # 显示正在使用的账户
-                    request_count = self.auth_manager.get_request_count(account_id) + 1
-                    print(f'\033[36m使用账户 {account_id} (今日第 #{request_count} 次请求)\033[0m')
-                    
-                    # 获取此账户的有效访问token
-                    access_token = await self.auth_manager.get_valid_access_token(account_id)
-                    
-                    # 获取API端点
-                    api_endpoint = await self.get_api_endpoint(credentials)
-                    
-                    # 进行API调用
-                    url = f"{api_endpoint}/embeddings"
-                    payload = {
-                        'model': request.model or 'text-embedding-v1',
-                        'input': request.input
-                    }
-                    
-                    headers = {
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {access_token}',
-                        'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)'
-                    }
-                    
-                    # 增加此账户的请求计数
-                    await self.auth_manager.increment_request_count(account_id)
-                    
-                    async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                        response = await client.post(url, json=payload, headers=headers)
-                        response.raise_for_status()
-                        return response.json()
-                        
-                except Exception as error:
-                    last_error = error
-                    
-                    # 检查是否为配额超出错误
-                    if is_quota_exceeded_error(error):
-                        print(f'\033[33m账户 {account_id} 配额已超出 (第 #{self.auth_manager.get_request_count(account_id)} 次请求)，轮换到下一个账户...\033[0m')
-                        # 移动到下一个账户用于下次请求
-                        current_account_index = (current_account_index + 1) % len(account_ids)
-                        # 预览下一个账户以显示我们将轮换到哪个
-                        next_account_id = account_ids[current_account_index]
-                        print(f'\033[33m将尝试下一个账户 {next_account_id}\033[0m')
-                        # 继续到下一个账户
-                        continue
-                    
-                    # 其他错误处理与chat_completions类似
-                    if hasattr(error, 'response'):
-                        error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
-                        raise HTTPException(
-                            status_code=error.response.status_code,
-                            detail=f"Qwen API错误: {error.response.status_code} {error_data}"
-                        )
-                    else:
-                        raise HTTPException(status_code=500, detail=f"Qwen API请求失败: {str(error)}")
-            
-            # 如果到达这里，所有账户都失败了
-            raise HTTPException(status_code=500, detail=f"所有账户都失败了。最后错误: {str(last_error)}")
-    
-    async def stream_chat_completions(self, request: ChatCompletionRequest) -> AsyncGenerator[str, None]:
-        """流式聊天完成."""
-        # 加载所有账户以支持多账户
-        await self.auth_manager.load_all_accounts()
-        account_ids = self.auth_manager.get_account_ids()
-        
-        # 如果没有额外账户，使用默认行为
-        if not account_ids:
-            # 获取有效的访问token（需要时自动刷新）
-            access_token = await self.auth_manager.get_valid_access_token()
-            credentials = await self.auth_manager.load_credentials()
-            api_endpoint = await self.get_api_endpoint(credentials)
-            
-            # 进行流式API调用
-            url = f"{api_endpoint}/chat/completions"
-            payload = {
-                'model': request.model or config.default_model,
-                'messages': [msg.model_dump() for msg in request.messages],
-                'temperature': request.temperature,
-                'max_tokens': request.max_tokens,
-                'top_p': request.top_p,
-                'tools': request.tools,
-                'tool_choice': request.tool_choice,
-                'stream': True,  # 启用流式
-                'stream_options': {'include_usage': True}  # 在最终块中包含使用数据
-            }
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {access_token}',
-                'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)',
-                'Accept': 'text/event-stream'
-            }
-            
-            try:
-                async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                    async with client.stream('POST', url, json=payload, headers=headers) as response:
-                        response.raise_for_status()
-                        
-                        async for chunk in response.aiter_text():
-                            if chunk:
+                    # 强制刷新token并用新Authorization重试一次
+                    new_access_token = await self._refresh_default_token(credentials)
+                    log.info('使用刷新后的token重试流式请求...')
+                    client = get_client()
+                    async with self._upstream_sem:
+                        async with client.stream('POST', url, content=body, headers=self._build_headers(new_access_token, stream=True)) as retry_response:
+                            retry_response.raise_for_status()
+                            log.info('刷新token后流式请求成功')
+
+                            async for chunk in retry_response.aiter_bytes():
                                 yield chunk
-                                
-            except Exception as error:
-                # 检查是否为可能受益于重试的认证错误
-                if is_auth_error(error):
-                    print(f'\033[33m检测到认证错误 ({getattr(error.response, "status_code", "N/A") if hasattr(error, "response") else "N/A"})，尝试刷新token并重试...\033[0m')
-                    try:
-                        # 强制刷新token并重试一次
-                        await self.auth_manager.perform_token_refresh(credentials)
-                        new_access_token = await self.auth_manager.get_valid_access_token()
-                        
-                        # 使用新token重试请求
-                        print('\033[36m使用刷新后的token重试流式请求...\033[0m')
-                        retry_headers = {
-                            'Content-Type': 'application/json',
-                            'Authorization': f'Bearer {new_access_token}',
-                            'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)',
-                            'Accept': 'text/event-stream'
-                        }
-                        
-                        async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                            async with client.stream('POST', url, json=payload, headers=retry_headers) as retry_response:
-                                retry_response.raise_for_status()
-                                print('\033[32m刷新token后流式请求成功\033[0m')
-                                
-                                async for chunk in retry_response.aiter_text():
-                                    if chunk:
-                                        yield chunk
-                                        
-                    except Exception as retry_error:
-                        print('\033[31m即使刷新token后流式请求仍然失败\033[0m')
-                        # 如果重试失败，抛出带有额外上下文的原始错误
-                        raise HTTPException(
-                            status_code=500,
-                            detail=f"Qwen API流式错误（刷新token尝试后）: {str(error)}"
-                        )
-                
-                if hasattr(error, 'response'):
-                    # 请求已发出，服务器返回状态码
-                    error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
+
+                    return
+
+                except Exception:
+                    log.error('即使刷新token后流式请求仍然失败')
+                    # 如果重试失败，抛出带有额外上下文的原始错误
                     raise HTTPException(
-                        status_code=error.response.status_code,
-                        detail=f"Qwen API错误: {error.response.status_code} {error_data}"
+                        status_code=500,
+                        detail=f"Qwen API流式错误（刷新token尝试后）: {str(error)}"
                     )
-                else:
-                    # 请求发出但未收到响应，或设置请求时发生错误
-                    raise HTTPException(status_code=500, detail=f"Qwen API请求失败: {str(error)}")
-        else:
-            # 多账户流式处理逻辑
-            # 从第一个账户开始（粘性选择）
-            current_account_index = 0
-            last_error = None
-            max_retries = len(account_ids)
-            
-            for i in range(max_retries):
-                try:
-                    # 获取当前账户（粘性直到配额错误）
-                    account_id = account_ids[current_account_index]
-                    credentials = self.auth_manager.get_account_credentials(account_id)
-                    
-                    if not credentials:
-                        # 如果当前账户无效，移动到下一个账户
-                        current_account_index = (current_account_index + 1) % len(account_ids)
-                        continue
-                    
-                    # 显示正在使用的账户
-                    request_count = self.auth_manager.get_request_count(account_id) + 1
-                    print(f'\033[36m使用账户 {account_id} (今日第 #{request_count} 次请求)\033[0m')
-                    
-                    # 获取此账户的有效访问token
-                    access_token = await self.auth_manager.get_valid_access_token(account_id)
-                    
-                    # 获取API端点
-                    api_endpoint = await self.get_api_endpoint(credentials)
-                    
-                    # 进行流式API调用
-                    url = f"{api_endpoint}/chat/completions"
-                    payload = {
-                        'model': request.model or config.default_model,
-                        'messages': [msg.model_dump() for msg in request.messages],
-                        'temperature': request.temperature,
-                        'max_tokens': request.max_tokens,
-                        'top_p': request.top_p,
-                        'tools': request.tools,
-                        'tool_choice': request.tool_choice,
-                        'stream': True,  # 启用流式
-                        'stream_options': {'include_usage': True}  # 在最终块中包含使用数据
-                    }
-                    
-                    headers = {
-                        'Content-Type': 'application/json',
-                        'Authorization': f'Bearer {access_token}',
-                        'User-Agent': 'QwenOpenAIProxy/1.0.0 (linux; x64)',
-                        'Accept': 'text/event-stream'
-                    }
-                    
-                    # 增加此账户的请求计数
-                    await self.auth_manager.increment_request_count(account_id)
-                    
-                    async with httpx.AsyncClient(timeout=config.api_timeout) as client:
-                        async with client.stream('POST', url, json=payload, headers=headers) as response:
-                            response.raise_for_status()
-                            
-                            async for chunk in response.aiter_text():
-                                if chunk:
-                                    yield chunk
-                    
-                    return  # 成功完成，退出循环
-                    
-                except Exception as error:
-                    last_error = error
-                    
-                    # 检查是否为配额超出错误
-                    if is_quota_exceeded_error(error):
-                        print(f'\033[33m账户 {account_id} 配额已超出 (第 #{self.auth_manager.get_request_count(account_id)} 次请求)，轮换到下一个账户...\033[0m')
-                        # 移动到下一个账户用于下次请求
-                        current_account_index = (current_account_index + 1) % len(account_ids)
-                        # 预览下一个账户以显示我们将轮换到哪个
-                        next_account_id = account_ids[current_account_index]
-                        print(f'\033[33m将尝试下一个账户 {next_account_id}\033[0m')
-                        # 继续到下一个账户
-                        continue
-                    
-                    # 其他错误处理
-                    if hasattr(error, 'response'):
-                        error_data = error.response.json() if hasattr(error.response, 'json') else str(error.response.text)
-                        raise HTTPException(
-                            status_code=error.response.status_code,
-                            detail=f"Qwen API错误: {error.response.status_code} {error_data}"
-                        )
-                    else:
-                        raise HTTPException(status_code=500, detail=f"Qwen API请求失败: {str(error)}")
-            
-            # 如果到达这里，所有账户都失败了
-            raise HTTPException(status_code=500, detail=f"所有账户都失败了。最后错误: {str(last_error)}")
\ No newline at end of file
+
+            raise self._translate_error(error)
+
+    # 转发给上游的请求字段（model单独处理以应用默认值）
+    _CHAT_PAYLOAD_FIELDS = {'messages', 'temperature', 'max_tokens', 'top_p', 'tools', 'tool_choice'}
+
+    async def chat_completions(self, request: ChatCompletionRequest) -> bytes:
+        """聊天完成API调用，返回上游响应字节."""
+        payload = self._build_chat_payload(request)
+        return await self._request('/chat/completions', payload)
+
+    def _build_chat_payload(self, request: ChatCompletionRequest) -> Dict[str, Any]:
+        """单次model_dump构建上游payload.
+
+        一次编译序列化器的整树遍历取代逐字段取值，
+        exclude_none同时避免把空的可选字段发给上游。
+        """
+        payload = request.model_dump(include=self._CHAT_PAYLOAD_FIELDS, exclude_none=True)
+        payload['model'] = request.model or config.default_model
+        return payload
+
+    async def list_models(self) -> ModelsResponse:
+        """列出模型."""
+        # 返回预构建的模拟列表（Qwen API没有此端点，内容不变，
+        # 无需每次调用重新构建并重验证嵌套模型）
+        return _MODELS_RESPONSE
+
+    # 嵌入输入的分片大小与分片间并发上限
+    _EMBEDDING_BATCH_SIZE = 16
+    _EMBEDDING_BATCH_CONCURRENCY = 8
+
+    async def create_embeddings(self, request: EmbeddingRequest) -> bytes:
+        """创建嵌入向量（大输入列表分片并发请求），返回上游响应字节."""
+        model = request.model or 'text-embedding-v1'
+
+        if isinstance(request.input, list) and len(request.input) > self._EMBEDDING_BATCH_SIZE:
+            return await self._create_embeddings_batched(model, request.input)
+
+        # payload只含必填字段，无需exclude_none过滤
+        payload = {
+            'model': model,
+            'input': request.input
+        }
+        return await self._request('/embeddings', payload)
+
+    async def _create_embeddings_batched(self, model: str, inputs: list) -> bytes:
+        """将输入分片后并发调用上游，按原顺序合并data与usage."""
+        size = self._EMBEDDING_BATCH_SIZE
+        batches = [inputs[i:i + size] for i in range(0, len(inputs), size)]
+        sem = asyncio.Semaphore(self._EMBEDDING_BATCH_CONCURRENCY)
+
+        async def run(batch: list) -> Dict[str, Any]:
+            async with sem:
+                return orjson.loads(await self._request('/embeddings', {'model': model, 'input': batch}))
+
+        results = await asyncio.gather(*(run(batch) for batch in batches))
+
+        # 合并各分片的data，index按原始输入顺序重排
+        data = []
+        for result in results:
+            for item in result.get('data', []):
+                item['index'] = len(data)
+                data.append(item)
+
+        merged: Dict[str, Any] = {'object': 'list', 'data': data, 'model': model}
+
+        # 累加usage统计
+        prompt_tokens = total_tokens = 0
+        has_usage = False
+        for result in results:
+            usage = result.get('usage')
+            if usage:
+                has_usage = True
+                prompt_tokens += usage.get('prompt_tokens', 0)
+                total_tokens += usage.get('total_tokens', 0)
+        if has_usage:
+            merged['usage'] = {'prompt_tokens': prompt_tokens, 'total_tokens': total_tokens}
+
+        return orjson.dumps(merged)
+
+    async def stream_chat_completions(self, request: ChatCompletionRequest) -> AsyncGenerator[bytes, None]:
+        """流式聊天完成."""
+        # 与非流式路径共享同一payload构建，仅叠加流式开关；
+        # 请求体随后在_stream_request中一次性编码并在轮换间复用
+        payload = self._build_chat_payload(request)
+        payload.update(_STREAM_PAYLOAD_EXTRA)
+        async for chunk in self._stream_request('/chat/completions', payload):
+            yield chunk
@@ -2,39 +2,82 @@
 
 import os
 import json
+import logging
+import re
+import time
 import hashlib
 import base64
+import random
 import secrets
 import asyncio
 from pathlib import Path
 from typing import Optional, Dict, Any, Tuple, List
-from datetime import datetime
 
+import aiofiles
 import httpx
+import msgspec
+import orjson
 import qrcode
 from models import QwenCredentials, DeviceFlowResponse, TokenResponse
+
+# 预构建的凭据解码器：直接从JSON字节解码为QwenCredentials结构体
+_CREDENTIALS_DECODER = msgspec.json.Decoder(QwenCredentials)
+from qwen.client import get_client
 from config import config
 
 
+log = logging.getLogger(__name__)
+
+
 # 文件系统配置
 QWEN_DIR = '.qwen'
 QWEN_CREDENTIAL_FILENAME = 'oauth_creds.json'
 QWEN_MULTI_ACCOUNT_PREFIX = 'oauth_creds_'
 QWEN_MULTI_ACCOUNT_SUFFIX = '.json'
 
+# 从凭据文件名一次性提取账户ID（预编译，取代循环内对常量的len()切片）
+_ACCOUNT_FILE_RE = re.compile(
+    rf'^{re.escape(QWEN_MULTI_ACCOUNT_PREFIX)}(.+){re.escape(QWEN_MULTI_ACCOUNT_SUFFIX)}$'
+)
+
+# RFC 8628标准轮询错误的分派表：error_type -> (动作, 终止消息)，
+# 取代逐个if分支里对status_code的重复比较
+_POLL_HANDLERS = {
+    'authorization_pending': ('retry', None),
+    'slow_down': ('slow_down', None),
+    'expired_token': ('raise', '❌ 设备代码已过期。请重新启动认证过程。'),
+    'access_denied': ('raise', '❌ 用户拒绝授权。请重新启动认证过程。'),
+}
+
 # OAuth配置
 TOKEN_REFRESH_BUFFER_MS = 30 * 1000  # 30秒
+# token刷新的独立超时与重试上限：共享客户端的默认超时面向长聊天请求，
+# 对持锁的刷新来说太宽，一个挂死的OAuth端点会阻塞所有等锁者
+_REFRESH_TIMEOUT = httpx.Timeout(connect=5.0, read=10.0, write=5.0, pool=5.0)
+_REFRESH_MAX_ATTEMPTS = 3
+# 距过期不足此时长时在后台提前刷新，请求路径永远不等OAuth往返
+PROACTIVE_REFRESH_BUFFER_MS = 5 * 60 * 1000  # 5分钟
+
+
+def _now_ms() -> int:
+    """当前Unix时间（毫秒）：跳过datetime对象构造，每个请求都会调用."""
+    return int(time.time() * 1000)
+
+
+def _today_utc() -> str:
+    """当前UTC日期字符串（计数按UTC日重置，本地时钟会在时区边界提前/滞后）."""
+    return time.strftime('%Y-%m-%d', time.gmtime())
 
 
 def generate_code_verifier() -> str:
-    """生成PKCE代码验证器."""
-    return base64.urlsafe_b64encode(secrets.token_bytes(32)).decode().rstrip('=')
+    """生成PKCE代码验证器（token_urlsafe直接产出RFC 7636合规字符串）."""
+    return secrets.token_urlsafe(32)
 
 
 def generate_code_challenge(code_verifier: str) -> str:
-    """从代码验证器生成代码挑战."""
-    digest = hashlib.sha256(code_verifier.encode()).digest()
-    return base64.urlsafe_b64encode(digest).decode().rstrip('=')
+    """从代码验证器生成代码挑战（base64操作全程走bytes，最后解码一次）."""
+    digest = hashlib.sha256(code_verifier.encode('ascii')).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
 
 
 def generate_pkce_pair() -> Tuple[str, str]:
@@ -54,81 +97,154 @@ class QwenAuthManager:
         
         self.credentials_path = self.qwen_dir / QWEN_CREDENTIAL_FILENAME
         self.credentials: Optional[QwenCredentials] = None
-        self.refresh_lock = asyncio.Lock()
+        # 默认凭据文件的mtime快照：未变化时load_credentials直接返回缓存
+        self._cred_mtime_ns: Optional[int] = None
+        # 上次写入的凭据内容摘要：内容未变时save_credentials跳过磁盘写
+        self._cred_payload_hash: Dict[str, bytes] = {}
+        # 按账户分锁：账户A的刷新不应串行化账户B的请求
+        self._refresh_locks: Dict[str, asyncio.Lock] = {}
         self.accounts: Dict[str, QwenCredentials] = {}
-        self.current_account_index = 0
         self.request_counts: Dict[str, int] = {}
-        self.last_reset_date = datetime.now().strftime('%Y-%m-%d')
+        self.last_reset_date = _today_utc()
         self.request_count_file = self.qwen_dir / 'request_counts.json'
+        # 凭据目录的(文件名, mtime_ns)签名：未变化时load_all_accounts
+        # 跳过重新解析（比目录mtime更强：也能捕获文件原地改写）
+        self._accounts_dir_sig: Optional[Tuple[Tuple[str, int], ...]] = None
+        # 进行中的主动刷新任务：account key -> Task，避免并发请求重复刷新
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # 计数有未落盘的变更时置位，由后台任务周期性刷写
+        self._counts_dirty = False
         
         # 加载请求计数将在第一次调用时完成
     
     async def load_credentials(self) -> Optional[QwenCredentials]:
-        """加载默认凭据."""
-        if self.credentials:
+        """加载默认凭据.
+
+        以文件mtime为失效依据：未变化时直接返回缓存实例（每个默认
+        账户请求都会走到这里），外部工具（如Qwen CLI重新认证）改写
+        文件后下次调用自动重读。
+        """
+        try:
+            stat = self.credentials_path.stat()
+        except OSError:
+            # 文件不存在：保留进程内已有的凭据（可能刚通过设备流获得）
             return self.credentials
-        
+
+        if self.credentials is not None and self._cred_mtime_ns == stat.st_mtime_ns:
+            return self.credentials
+
         try:
-            if self.credentials_path.exists():
-                data = json.loads(self.credentials_path.read_text(encoding='utf-8'))
-                self.credentials = QwenCredentials(**data)
-                return self.credentials
+            self.credentials = _CREDENTIALS_DECODER.decode(self.credentials_path.read_bytes())
+            self._cred_mtime_ns = stat.st_mtime_ns
         except Exception:
             pass
-        
-        return None
+
+        return self.credentials
     
     async def load_all_accounts(self) -> Dict[str, QwenCredentials]:
-        """加载所有多账户凭据."""
+        """加载所有多账户凭据.
+
+        账户集合很少变化：用os.scandir对每个凭据文件取(文件名,
+        mtime_ns)构成签名，与上次一致时直接返回内存中的账户映射，
+        不读也不解析任何文件；增删或改写账户文件都会改变签名。
+        scandir的stat结果来自目录项缓存，整个签名只是一次目录遍历。
+        """
         try:
-            self.accounts.clear()
-            
-            # 读取目录中的所有凭据文件
-            for file_path in self.qwen_dir.glob(f"{QWEN_MULTI_ACCOUNT_PREFIX}*{QWEN_MULTI_ACCOUNT_SUFFIX}"):
+            try:
+                with os.scandir(self.qwen_dir) as entries:
+                    sig = tuple(sorted(
+                        (e.name, e.stat().st_mtime_ns)
+                        for e in entries
+                        if _ACCOUNT_FILE_RE.match(e.name)
+                    ))
+            except OSError:
+                sig = None
+
+            if sig is not None and sig == self._accounts_dir_sig:
+                return self.accounts
+
+            # 并发读取目录中的所有凭据文件：逐个同步read_bytes会把
+            # N次磁盘往返串行压在事件循环线程上，aiofiles+gather让
+            # 读取既不阻塞事件循环又相互并行
+            async def _load_one(file_path: Path) -> Optional[Tuple[Path, QwenCredentials]]:
                 try:
-                    data = json.loads(file_path.read_text(encoding='utf-8'))
-                    credentials = QwenCredentials(**data)
-                    
-                    # 从文件名提取账户ID
-                    filename = file_path.name
-                    account_id = filename[len(QWEN_MULTI_ACCOUNT_PREFIX):-len(QWEN_MULTI_ACCOUNT_SUFFIX)]
-                    
-                    self.accounts[account_id] = credentials
+                    async with aiofiles.open(file_path, 'rb') as f:
+                        return file_path, _CREDENTIALS_DECODER.decode(await f.read())
                 except Exception as e:
-                    print(f"警告: 无法加载账户文件 {file_path}: {e}")
+                    log.warning(f"无法加载账户文件 {file_path}: {e}")
+                    return None
+
+            paths = [self.qwen_dir / name for name, _ in sig] if sig is not None else \
+                list(self.qwen_dir.glob(f"{QWEN_MULTI_ACCOUNT_PREFIX}*{QWEN_MULTI_ACCOUNT_SUFFIX}"))
+            results = await asyncio.gather(*(_load_one(p) for p in paths))
+
+            self.accounts.clear()
+            for item in results:
+                if item is None:
+                    continue
+                file_path, credentials = item
+                # 从文件名提取账户ID
+                match = _ACCOUNT_FILE_RE.match(file_path.name)
+                if not match:
+                    continue
+                self.accounts[match.group(1)] = credentials
             
+            self._accounts_dir_sig = sig
             return self.accounts
         except Exception as e:
-            print(f"警告: 无法加载多账户凭据: {e}")
+            log.warning(f"无法加载多账户凭据: {e}")
             return self.accounts
     
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        """写临时文件后原子替换：崩溃不会留下截断的半个JSON."""
+        tmp_path = path.with_suffix('.json.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
     async def save_credentials(self, credentials: QwenCredentials, account_id: Optional[str] = None):
-        """保存凭据."""
+        """保存凭据（原子写入，序列化只做一次）."""
         try:
-            cred_data = credentials.model_dump()
+            # orjson直接产出UTF-8字节，跳过str中间产物与再编码
+            payload = orjson.dumps(msgspec.to_builtins(credentials))
+
+            # 内容与上次写入完全一致时跳过磁盘写，只同步内存映射
+            key = account_id or "__default__"
+            digest = hashlib.blake2b(payload, digest_size=16).digest()
+            if self._cred_payload_hash.get(key) == digest:
+                if account_id:
+                    self.accounts[account_id] = credentials
+                else:
+                    self.credentials = credentials
+                return
             
             if account_id:
                 # 保存到特定账户文件
                 account_filename = f"{QWEN_MULTI_ACCOUNT_PREFIX}{account_id}{QWEN_MULTI_ACCOUNT_SUFFIX}"
                 account_path = self.qwen_dir / account_filename
-                account_path.write_text(json.dumps(cred_data, indent=2, ensure_ascii=False), encoding='utf-8')
+                self._write_atomic(account_path, payload)
                 
                 # 更新账户映射
                 self.accounts[account_id] = credentials
             else:
-                # 保存到默认凭据文件
-                self.credentials_path.write_text(json.dumps(cred_data, indent=2, ensure_ascii=False), encoding='utf-8')
+                # 保存到默认凭据文件，并同步mtime快照避免下次无谓重读
+                self._write_atomic(self.credentials_path, payload)
                 self.credentials = credentials
+                try:
+                    self._cred_mtime_ns = self.credentials_path.stat().st_mtime_ns
+                except OSError:
+                    self._cred_mtime_ns = None
+            
+            self._cred_payload_hash[key] = digest
         except Exception as e:
-            print(f"错误: 保存凭据失败: {e}")
+            log.error(f"保存凭据失败: {e}")
     
     def is_token_valid(self, credentials: QwenCredentials) -> bool:
         """检查token是否有效."""
         if not credentials or not credentials.expiry_date:
             return False
         
-        current_time = int(datetime.now().timestamp() * 1000)
-        return current_time < credentials.expiry_date - TOKEN_REFRESH_BUFFER_MS
+        return _now_ms() < credentials.expiry_date - TOKEN_REFRESH_BUFFER_MS
     
     def get_account_ids(self) -> List[str]:
         """获取所有账户ID列表."""
@@ -156,16 +272,16 @@ class QwenAuthManager:
             if account_id in self.accounts:
                 del self.accounts[account_id]
             
-            print(f"账户 {account_id} 已成功删除")
+            log.info(f"账户 {account_id} 已成功删除")
         except Exception as e:
-            print(f"错误: 删除账户 {account_id} 失败: {e}")
+            log.error(f"删除账户 {account_id} 失败: {e}")
             raise
     
     async def load_request_counts(self):
         """从磁盘加载请求计数."""
         try:
             if self.request_count_file.exists():
-                data = json.loads(self.request_count_file.read_text(encoding='utf-8'))
+                data = orjson.loads(self.request_count_file.read_bytes())
                 
                 # 恢复上次重置日期
                 if 'lastResetDate' in data:
@@ -182,31 +298,41 @@ class QwenAuthManager:
             self.reset_request_counts_if_needed()
     
     async def save_request_counts(self):
-        """将请求计数保存到磁盘."""
+        """将请求计数保存到磁盘（先写临时文件再原子替换，避免写坏）."""
         try:
             data = {
                 'lastResetDate': self.last_reset_date,
                 'requests': self.request_counts
             }
-            self.request_count_file.write_text(json.dumps(data, indent=2), encoding='utf-8')
+            self._write_atomic(self.request_count_file, orjson.dumps(data, option=orjson.OPT_INDENT_2))
         except Exception as e:
-            print(f"警告: 保存请求计数失败: {e}")
+            log.warning(f"保存请求计数失败: {e}")
+
+    async def flush_request_counts(self):
+        """如有未落盘的计数变更则持久化（由后台任务与关闭钩子调用）."""
+        if self._counts_dirty:
+            self._counts_dirty = False
+            await self.save_request_counts()
     
     def reset_request_counts_if_needed(self):
         """如果跨入新的UTC日，重置请求计数."""
-        today = datetime.now().strftime('%Y-%m-%d')
+        today = _today_utc()
         if today != self.last_reset_date:
             self.request_counts.clear()
             self.last_reset_date = today
-            print("新UTC日的请求计数已重置")
-            asyncio.create_task(self.save_request_counts())
+            log.info("新UTC日的请求计数已重置")
+            self._counts_dirty = True
     
     async def increment_request_count(self, account_id: str):
-        """增加账户的请求计数."""
+        """增加账户的请求计数.
+
+        只更新内存计数并打脏标记：每次请求都重写整个JSON文件
+        相当于用户态的fsync风暴，落盘由后台任务按周期合并完成。
+        """
         self.reset_request_counts_if_needed()
         current_count = self.request_counts.get(account_id, 0)
         self.request_counts[account_id] = current_count + 1
-        await self.save_request_counts()
+        self._counts_dirty = True
     
     def get_request_count(self, account_id: str) -> int:
         """获取账户的请求计数."""
@@ -215,7 +341,7 @@ class QwenAuthManager:
     
     async def refresh_access_token(self, credentials: QwenCredentials) -> QwenCredentials:
         """刷新访问token."""
-        print('\033[33m正在刷新Qwen访问token...\033[0m')
+        log.info('正在刷新Qwen访问token...')
         
         if not credentials or not credentials.refresh_token:
             raise Exception("无刷新token可用。请使用Qwen CLI重新认证。")
@@ -227,79 +353,133 @@ class QwenAuthManager:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    config.qwen.token_endpoint,
-                    data=body_data,
-                    headers={
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                        'Accept': 'application/json'
-                    }
-                )
-                
-                if response.status_code != 200:
-                    error_data = response.json()
-                    raise Exception(f"Token刷新失败: {error_data.get('error')} - {error_data.get('error_description')}")
-                
-                token_data = response.json()
-                
-                new_credentials = QwenCredentials(
-                    access_token=token_data['access_token'],
-                    token_type=token_data.get('token_type', 'Bearer'),
-                    refresh_token=token_data.get('refresh_token', credentials.refresh_token),
-                    resource_url=token_data.get('resource_url', credentials.resource_url),
-                    expiry_date=int(datetime.now().timestamp() * 1000) + token_data['expires_in'] * 1000
-                )
-                
-                print('\033[32mQwen访问token刷新成功\033[0m')
-                return new_credentials
-                
+            client = get_client()
+            # 有界重试：5xx与传输错误短暂指数退避后再试，最终失败立即
+            # 抛出，让等待刷新锁的协程尽快看到错误而不是无限期排队
+            for attempt in range(_REFRESH_MAX_ATTEMPTS):
+                try:
+                    response = await client.post(
+                        config.qwen.token_endpoint,
+                        data=body_data,
+                        headers={
+                            'Content-Type': 'application/x-www-form-urlencoded',
+                            'Accept': 'application/json'
+                        },
+                        timeout=_REFRESH_TIMEOUT,
+                    )
+                except httpx.TransportError:
+                    if attempt == _REFRESH_MAX_ATTEMPTS - 1:
+                        raise
+                    await asyncio.sleep(0.2 * 2 ** attempt)
+                    continue
+                if response.status_code >= 500 and attempt < _REFRESH_MAX_ATTEMPTS - 1:
+                    await asyncio.sleep(0.2 * 2 ** attempt)
+                    continue
+                break
+
+            if response.status_code != 200:
+                error_data = response.json()
+                raise Exception(f"Token刷新失败: {error_data.get('error')} - {error_data.get('error_description')}")
+
+            token_data = response.json()
+
+            new_credentials = QwenCredentials(
+                access_token=token_data['access_token'],
+                token_type=token_data.get('token_type', 'Bearer'),
+                refresh_token=token_data.get('refresh_token', credentials.refresh_token),
+                resource_url=token_data.get('resource_url', credentials.resource_url),
+                expiry_date=_now_ms() + token_data['expires_in'] * 1000
+            )
+
+            log.info('Qwen访问token刷新成功')
+            return new_credentials
+
         except Exception as e:
-            print('\033[31m刷新Qwen访问token失败\033[0m')
+            log.error('刷新Qwen访问token失败')
             raise Exception("刷新访问token失败。请使用Qwen CLI重新认证。")
     
+    async def _load_credentials_for(self, account_id: Optional[str]) -> Optional[QwenCredentials]:
+        """加载指定账户（或默认）的凭据."""
+        if account_id:
+            credentials = self.get_account_credentials(account_id)
+            if not credentials:
+                # 如果未加载，加载所有账户
+                await self.load_all_accounts()
+                credentials = self.get_account_credentials(account_id)
+            return credentials
+        return await self.load_credentials()
+
+    def _lock_for(self, account_id: Optional[str]) -> asyncio.Lock:
+        """返回指定账户的刷新锁（惰性创建）."""
+        key = account_id or "__default__"
+        lock = self._refresh_locks.get(key)
+        if lock is None:
+            lock = self._refresh_locks[key] = asyncio.Lock()
+        return lock
+
+    def _schedule_proactive_refresh(self, credentials: QwenCredentials, account_id: Optional[str]):
+        """调度一次后台token刷新（同一账户最多一个在途任务）."""
+        key = account_id or "__default__"
+        if key in self._inflight:
+            return
+
+        task = asyncio.create_task(self.perform_token_refresh(credentials, account_id))
+        self._inflight[key] = task
+
+        def _done(t: asyncio.Task, key: str = key):
+            self._inflight.pop(key, None)
+            if not t.cancelled() and t.exception():
+                log.warning(f"{key} 的主动token刷新失败: {t.exception()}")
+
+        task.add_done_callback(_done)
+
     async def get_valid_access_token(self, account_id: Optional[str] = None) -> str:
-        """获取有效的访问token."""
-        async with self.refresh_lock:
-            try:
-                credentials = None
-                
+        """获取有效的访问token.
+
+        双重检查模式：token有效的常见路径完全不取锁，每个请求都
+        经过这里，全量加锁会把所有请求串行化在一个互斥量上；只有
+        需要刷新时才取该账户自己的刷新锁，并在锁内重读凭据——排队等锁
+        的协程醒来时刷新可能已由别人完成，直接复用即可。
+        """
+        credentials = await self._load_credentials_for(account_id)
+
+        if not credentials:
+            if account_id:
+                raise Exception(f"未找到账户 {account_id} 的凭据。请先认证此账户。")
+            raise Exception("未找到凭据。请先使用Qwen CLI认证。")
+
+        # 无锁快速路径：token有效时直接返回；临近过期则先调度后台刷新，
+        # 把OAuth往返移出请求关键路径
+        if self.is_token_valid(credentials):
+            if credentials.expiry_date - _now_ms() < PROACTIVE_REFRESH_BUFFER_MS:
+                self._schedule_proactive_refresh(credentials, account_id)
+            # 每个请求都走到这里：只有调试级别启用时才构造消息字符串
+            if log.isEnabledFor(logging.DEBUG):
+                message = f"使用账户 {account_id} 的有效Qwen访问token" if account_id else "使用有效的Qwen访问token"
+                log.debug(message)
+            return credentials.access_token
+
+        async with self._lock_for(account_id):
+            # 锁内重新检查：等锁期间其他协程可能已完成刷新
+            credentials = await self._load_credentials_for(account_id)
+            if credentials and self.is_token_valid(credentials):
+                return credentials.access_token
+
+            if not credentials:
                 if account_id:
-                    # 获取特定账户的凭据
-                    credentials = self.get_account_credentials(account_id)
-                    if not credentials:
-                        # 如果未加载，加载所有账户
-                        await self.load_all_accounts()
-                        credentials = self.get_account_credentials(account_id)
-                else:
-                    # 使用默认凭据
-                    credentials = await self.load_credentials()
-                
-                if not credentials:
-                    if account_id:
-                        raise Exception(f"未找到账户 {account_id} 的凭据。请先认证此账户。")
-                    else:
-                        raise Exception("未找到凭据。请先使用Qwen CLI认证。")
-                
-                # 检查token是否有效
-                if self.is_token_valid(credentials):
-                    message = f"使用账户 {account_id} 的有效Qwen访问token" if account_id else "使用有效的Qwen访问token"
-                    print(f'\033[32m{message}\033[0m')
-                    return credentials.access_token
-                else:
-                    message = f"账户 {account_id} 的Qwen访问token已过期或即将过期，正在刷新..." if account_id else "Qwen访问token已过期或即将过期，正在刷新..."
-                    print(f'\033[33m{message}\033[0m')
-                
-                # Token需要刷新
-                new_credentials = await self.refresh_access_token(credentials)
-                
-                # 保存到适当的账户
-                await self.save_credentials(new_credentials, account_id)
-                
-                return new_credentials.access_token
-                
-            except Exception as e:
-                raise Exception(str(e))
+                    raise Exception(f"未找到账户 {account_id} 的凭据。请先认证此账户。")
+                raise Exception("未找到凭据。请先使用Qwen CLI认证。")
+
+            message = f"账户 {account_id} 的Qwen访问token已过期或即将过期，正在刷新..." if account_id else "Qwen访问token已过期或即将过期，正在刷新..."
+            log.info(message)
+
+            # Token需要刷新
+            new_credentials = await self.refresh_access_token(credentials)
+
+            # 保存到适当的账户
+            await self.save_credentials(new_credentials, account_id)
+
+            return new_credentials.access_token
     
     async def perform_token_refresh(self, credentials: QwenCredentials, account_id: Optional[str] = None) -> QwenCredentials:
         """执行token刷新."""
@@ -313,50 +493,50 @@ class QwenAuthManager:
         except Exception as e:
             raise Exception(str(e))
     
-    async def get_next_account(self) -> Optional[Dict[str, Any]]:
-        """获取下一个可用账户进行轮询."""
-        # 如果未加载账户，先加载
-        if not self.accounts:
-            await self.load_all_accounts()
-        
-        account_ids = self.get_account_ids()
-        
-        if not account_ids:
-            return None
-        
-        # 使用轮询选择
-        account_id = account_ids[self.current_account_index]
-        credentials = self.get_account_credentials(account_id)
-        
-        # 更新下次调用的索引
-        self.current_account_index = (self.current_account_index + 1) % len(account_ids)
-        
-        return {"accountId": account_id, "credentials": credentials}
-    
-    def get_current_account(self) -> Optional[Dict[str, Any]]:
-        """获取当前账户（轮询模式）."""
-        if not self.accounts:
-            return None
-        
-        account_ids = self.get_account_ids()
-        if not account_ids:
-            return None
-        
-        # 获取当前账户
-        account_id = account_ids[self.current_account_index]
-        credentials = self.get_account_credentials(account_id)
-        
-        return {"accountId": account_id, "credentials": credentials}
-    
-    def rotate_to_next_account(self):
-        """轮换到下一个账户."""
-        if not self.accounts:
+    async def warmup_accounts(self):
+        """并发刷新所有token已失效的账户.
+
+        启动后（例如代理重启）多个账户往往同时过期，按请求到达
+        逐个刷新要付N次串行OAuth往返；这里一次gather全部刷完，
+        流量到来时轮换路径只会命中有效token。
+        """
+        await self.load_all_accounts()
+        stale = [
+            (account_id, credentials)
+            for account_id, credentials in self.accounts.items()
+            if credentials.refresh_token and not self.is_token_valid(credentials)
+        ]
+        if not stale:
             return
-        
-        account_ids = self.get_account_ids()
-        if len(account_ids) > 1:
-            self.current_account_index = (self.current_account_index + 1) % len(account_ids)
-    
+
+        log.info(f"启动预热：并发刷新 {len(stale)} 个账户的过期token")
+        results = await asyncio.gather(
+            *(self.perform_token_refresh(credentials, account_id) for account_id, credentials in stale),
+            return_exceptions=True,
+        )
+        for (account_id, _), result in zip(stale, results):
+            if isinstance(result, BaseException):
+                log.warning(f"账户 {account_id} 的预热刷新失败: {result}")
+
+    async def refresh_if_needed(self, account_id: Optional[str] = None):
+        """如果token即将过期则提前刷新（供后台任务在请求路径外调用）."""
+        try:
+            if account_id:
+                credentials = self.get_account_credentials(account_id)
+            else:
+                credentials = await self.load_credentials()
+
+            if not credentials or not credentials.refresh_token:
+                return
+
+            if self.is_token_valid(credentials):
+                return
+
+            await self.perform_token_refresh(credentials, account_id)
+        except Exception as e:
+            target = f"账户 {account_id}" if account_id else "默认账户"
+            log.warning(f"{target} 的后台token刷新失败: {e}")
+
     def is_account_valid(self, account_id: str) -> bool:
         """检查账户是否有有效凭据."""
         credentials = self.get_account_credentials(account_id)
@@ -375,56 +555,65 @@ class QwenAuthManager:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    config.qwen.device_code_endpoint,
-                    data=body_data,
-                    headers={
-                        'Content-Type': 'application/x-www-form-urlencoded',
-                        'Accept': 'application/json'
-                    }
-                )
-                
-                if response.status_code != 200:
-                    error_text = response.text
-                    raise Exception(f"设备授权失败: {response.status_code} {response.reason_phrase}. 响应: {error_text}")
-                
-                result = response.json()
-                
-                # 检查响应是否表示成功
-                if 'device_code' not in result:
-                    error = result.get('error', '未知错误')
-                    error_description = result.get('error_description', '无详细信息')
-                    raise Exception(f"设备授权失败: {error} - {error_description}")
-                
-                # 将代码验证器添加到结果中，以便稍后用于轮询
-                # 如果有完整的验证URI，使用它
-                verification_uri = result.get('verification_uri_complete', result['verification_uri'])
-                
-                return DeviceFlowResponse(
-                    device_code=result['device_code'],
-                    user_code=result['user_code'],
-                    verification_uri=verification_uri,
-                    expires_in=result['expires_in'],
-                    interval=result.get('interval', 5),
-                    code_verifier=code_verifier
-                )
-                
+            client = get_client()
+            response = await client.post(
+                config.qwen.device_code_endpoint,
+                data=body_data,
+                headers={
+                    'Content-Type': 'application/x-www-form-urlencoded',
+                    'Accept': 'application/json'
+                }
+            )
+
+            if response.status_code != 200:
+                error_text = response.text
+                raise Exception(f"设备授权失败: {response.status_code} {response.reason_phrase}. 响应: {error_text}")
+
+            result = response.json()
+
+            # 检查响应是否表示成功
+            if 'device_code' not in result:
+                error = result.get('error', '未知错误')
+                error_description = result.get('error_description', '无详细信息')
+                raise Exception(f"设备授权失败: {error} - {error_description}")
+
+            # 将代码验证器添加到结果中，以便稍后用于轮询
+            # 如果有完整的验证URI，使用它
+            verification_uri = result.get('verification_uri_complete', result['verification_uri'])
+
+            return DeviceFlowResponse(
+                device_code=result['device_code'],
+                user_code=result['user_code'],
+                verification_uri=verification_uri,
+                expires_in=result['expires_in'],
+                interval=result.get('interval', 5),
+                code_verifier=code_verifier
+            )
+
         except Exception as e:
-            print(f"设备授权流程失败: {e}")
+            log.error(f"设备授权流程失败: {e}")
             raise
     
     async def poll_for_token(
-        self, 
-        device_code: str, 
-        code_verifier: str, 
-        account_id: Optional[str] = None
+        self,
+        device_code: str,
+        code_verifier: str,
+        account_id: Optional[str] = None,
+        interval: int = 5,
+        expires_in: Optional[int] = None
     ) -> QwenCredentials:
-        """轮询token."""
-        poll_interval = 5  # 5秒
-        max_attempts = 60  # 最多5分钟
-        
-        for attempt in range(max_attempts):
+        """轮询token.
+
+        遵循RFC 8628：使用服务器返回的interval作为初始轮询间隔，
+        收到slow_down时增加5秒，其他可重试错误时指数退避（最大60秒），
+        并以单调时钟按expires_in限制总等待时间。
+        """
+        poll_interval = max(interval, 1)
+        deadline = time.monotonic() + (expires_in if expires_in else 300)
+        attempt = 0
+
+        while time.monotonic() < deadline:
+            attempt += 1
             body_data = {
                 'grant_type': 'urn:ietf:params:oauth:grant-type:device_code',
                 'client_id': config.qwen.client_id,
@@ -434,83 +623,91 @@ class QwenAuthManager:
             }
             
             try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        config.qwen.token_endpoint,
-                        data=body_data,
-                        headers={
-                            'Content-Type': 'application/x-www-form-urlencoded',
-                            'Accept': 'application/json'
-                        }
-                    )
-                    
-                    if response.status_code != 200:
-                        # 解析响应为JSON以检查OAuth RFC 8628标准错误
-                        try:
-                            error_data = response.json()
-                            error_type = error_data.get('error', 'unknown_error')
-                            error_desc = error_data.get('error_description', '无详细信息')
-                            
-                            # 根据OAuth RFC 8628处理标准轮询响应
-                            if response.status_code == 400 and error_type == 'authorization_pending':
-                                # 用户尚未批准授权请求。继续轮询。
-                                print(f"轮询尝试 {attempt + 1}/{max_attempts}... (等待用户授权)")
-                                await asyncio.sleep(poll_interval)
+                client = get_client()
+                response = await client.post(
+                    config.qwen.token_endpoint,
+                    data=body_data,
+                    headers={
+                        'Content-Type': 'application/x-www-form-urlencoded',
+                        'Accept': 'application/json'
+                    }
+                )
+
+                if response.status_code != 200:
+                    # 解析响应为JSON以检查OAuth RFC 8628标准错误
+                    try:
+                        error_data = response.json()
+                        error_type = error_data.get('error', 'unknown_error')
+                        error_desc = error_data.get('error_description', '无详细信息')
+
+                        # 根据OAuth RFC 8628处理标准轮询响应：status_code只
+                        # 比较一次，标准error_type走O(1)分派表
+                        if response.status_code == 400:
+                            action, message = _POLL_HANDLERS.get(error_type, ('error', None))
+
+                            if action == 'retry':
+                                # 用户尚未批准授权请求。继续轮询，间隔温和
+                                # 递增并加抖动：用户授权越久，打到OAuth
+                                # 服务器的请求越稀疏
+                                log.info(f"轮询尝试 {attempt}... (等待用户授权)")
+                                await asyncio.sleep(poll_interval + random.uniform(0, 0.5))
+                                poll_interval = min(poll_interval * 1.2, 10)
                                 continue
-                            
-                            if response.status_code == 400 and error_type == 'slow_down':
-                                # 客户端轮询过于频繁。增加轮询间隔。
-                                poll_interval = min(poll_interval * 1.5, 10)  # 增加50%，最大10秒
-                                print(f"服务器要求放慢速度，将轮询间隔增加到 {poll_interval:.1f}秒")
+
+                            if action == 'slow_down':
+                                # 客户端轮询过于频繁。按RFC 8628将间隔增加5秒。
+                                poll_interval += 5
+                                log.info(f"服务器要求放慢速度，将轮询间隔增加到 {poll_interval:.1f}秒")
                                 await asyncio.sleep(poll_interval)
                                 continue
-                            
-                            if response.status_code == 400 and error_type == 'expired_token':
-                                raise Exception("❌ 设备代码已过期。请重新启动认证过程。")
-                            
-                            if response.status_code == 400 and error_type == 'access_denied':
-                                raise Exception("❌ 用户拒绝授权。请重新启动认证过程。")
-                            
+
+                            if action == 'raise':
+                                raise Exception(message)
+
                             # 特殊处理无效用户代码的情况
-                            if response.status_code == 400 and ('invalid' in error_type.lower() or 'invalid' in error_desc.lower()):
+                            if 'invalid' in error_type.lower() or 'invalid' in error_desc.lower():
                                 if 'user_code' in error_desc.lower() or 'code' in error_desc.lower():
                                     raise Exception(f"❌ 用户代码无效或已失效: {error_desc}\n请重新启动认证过程获取新的代码。")
-                            
-                            # 对于其他错误，抛出详细的错误信息
-                            raise Exception(f"设备token轮询失败: {error_type} - {error_desc}")
-                            
-                        except json.JSONDecodeError:
-                            # 如果JSON解析失败，回退到文本响应
-                            error_text = response.text
-                            raise Exception(f"设备token轮询失败: {response.status_code} {response.reason_phrase}. 响应: {error_text}")
-                    
-                    token_data = response.json()
-                    
-                    # 转换为QwenCredentials格式并保存
-                    credentials = QwenCredentials(
-                        access_token=token_data['access_token'],
-                        refresh_token=token_data.get('refresh_token'),
-                        token_type=token_data.get('token_type', 'Bearer'),
-                        resource_url=token_data.get('resource_url') or token_data.get('endpoint'),
-                        expiry_date=int(datetime.now().timestamp() * 1000) + token_data['expires_in'] * 1000 if token_data.get('expires_in') else None
-                    )
-                    
-                    await self.save_credentials(credentials, account_id)
-                    
-                    return credentials
-                    
+
+                        # 对于其他错误，抛出详细的错误信息
+                        raise Exception(f"设备token轮询失败: {error_type} - {error_desc}")
+
+                    except json.JSONDecodeError:
+                        # 如果JSON解析失败，回退到文本响应
+                        error_text = response.text
+                        raise Exception(f"设备token轮询失败: {response.status_code} {response.reason_phrase}. 响应: {error_text}")
+
+                token_data = response.json()
+
+                # 转换为QwenCredentials格式并保存
+                credentials = QwenCredentials(
+                    access_token=token_data['access_token'],
+                    refresh_token=token_data.get('refresh_token'),
+                    token_type=token_data.get('token_type', 'Bearer'),
+                    resource_url=token_data.get('resource_url') or token_data.get('endpoint'),
+                    expiry_date=_now_ms() + token_data['expires_in'] * 1000 if token_data.get('expires_in') else None
+                )
+
+                await self.save_credentials(credentials, account_id)
+
+                return credentials
+
             except Exception as e:
                 # 处理特定错误情况
                 error_message = str(e)
                 
                 # 如果我们得到应该停止轮询的特定OAuth错误，抛出它
-                if ('expired_token' in error_message or 
-                    'access_denied' in error_message or 
+                if ('expired_token' in error_message or
+                    'access_denied' in error_message or
+                    '设备代码已过期' in error_message or
+                    '用户拒绝授权' in error_message or
+                    '用户代码无效' in error_message or
                     '设备授权失败' in error_message):
                     raise
                 
-                # 对于其他错误，继续轮询
-                print(f"轮询尝试 {attempt + 1}/{max_attempts} 失败: {error_message}")
+                # 对于其他错误，指数退避后继续轮询
+                poll_interval = min(poll_interval * 2, 60)
+                log.warning(f"轮询尝试 {attempt} 失败: {error_message}")
                 await asyncio.sleep(poll_interval)
-        
+
         raise Exception("认证超时。请重新启动认证过程。")
\ No newline at end of file
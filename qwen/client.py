@@ -0,0 +1,35 @@
+"""共享HTTP客户端.
+
+auth和API调用共用一个带连接池的httpx.AsyncClient，
+复用到chat.qwen.ai/dashscope的TCP连接和TLS会话，
+并通过HTTP/2在单个连接上多路复用并发请求。
+"""
+
+from typing import Optional
+
+import httpx
+
+from config import config
+
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """获取共享的httpx.AsyncClient（惰性创建）."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=config.api_timeout,
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100)
+        )
+    return _client
+
+
+async def close_client():
+    """关闭共享客户端（在应用关闭时调用）."""
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
@@ -13,6 +13,7 @@ def main():
     parser = argparse.ArgumentParser(description="Qwen OpenAI代理服务器")
     parser.add_argument("--host", default=config.host, help=f"绑定地址 (默认: {config.host})")
     parser.add_argument("--port", type=int, default=config.port, help=f"监听端口 (默认: {config.port})")
+    parser.add_argument("--workers", type=int, default=config.workers, help=f"工作进程数 (默认: {config.workers})")
     parser.add_argument("--reload", action="store_true", help="启用自动重载 (开发模式)")
     parser.add_argument("--log-level", default="info", choices=["critical", "error", "warning", "info", "debug"], help="日志级别")
     
@@ -23,6 +24,9 @@ def main():
             "main:app",
             host=args.host,
             port=args.port,
+            loop="uvloop",
+            http="httptools",
+            workers=args.workers,
             reload=args.reload,
             log_level=args.log_level,
             access_log=False
@@ -1,23 +1,91 @@
 """调试日志记录工具."""
 
 import os
-import json
+import asyncio
+import logging
+import aiofiles
+import orjson
 import structlog
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from queue import Queue
 from typing import Optional, Dict, Any
 from config import config
 
 
+# ANSI颜色常量（模块加载时构造一次，避免热路径上的字符串拼接）
+RED = '\033[31m'
+GREEN = '\033[32m'
+YELLOW = '\033[33m'
+CYAN = '\033[36m'
+RESET = '\033[0m'
+
+
+class ColorFormatter(logging.Formatter):
+    """按日志级别着色的格式化器（每条记录只应用一次颜色代码）."""
+
+    LEVEL_COLORS = {
+        logging.DEBUG: CYAN,
+        logging.INFO: GREEN,
+        logging.WARNING: YELLOW,
+        logging.ERROR: RED,
+        logging.CRITICAL: RED,
+    }
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = super().format(record)
+        color = self.LEVEL_COLORS.get(record.levelno)
+        if color:
+            return ''.join((color, message, RESET))
+        return message
+
+
+def setup_queue_logging(level: int = logging.INFO) -> QueueListener:
+    """配置基于队列的日志记录.
+
+    请求处理器只将日志记录放入内存队列，格式化和stdout写入
+    由后台监听线程完成，避免在事件循环上同步刷新stdout。
+    """
+    log_queue = Queue(-1)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(ColorFormatter('%(levelname)s:     %(message)s'))
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [QueueHandler(log_queue)]
+
+    return listener
+
+
 class DebugLogger:
     """调试日志记录器."""
     
+    # 队列满时丢弃新日志条目而不是阻塞请求
+    QUEUE_MAXSIZE = 1000
+    # 每批最多写入的条目数
+    BATCH_SIZE = 32
+
     def __init__(self):
         """初始化日志记录器."""
         self.logger = structlog.get_logger()
+        self.enabled = config.debug_log  # 供调用方在序列化请求前快速检查
         self.log_dir = Path.home() / '.qwen' / 'debug_logs'
         self.log_dir.mkdir(parents=True, exist_ok=True)
-        
+        # 单一追加式NDJSON文件：每条日志一次append，不再按调用建文件
+        self._log_path = self.log_dir / 'debug.ndjson'
+        self._queue: Optional[asyncio.Queue] = None
+        self._writer_task: Optional[asyncio.Task] = None
+
+    def _ensure_writer(self):
+        """惰性启动后台写入任务（需要运行中的事件循环）."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.QUEUE_MAXSIZE)
+            self._writer_task = asyncio.create_task(self._write_loop())
+
     async def log_api_call(
         self,
         endpoint: str,
@@ -25,60 +93,113 @@ class DebugLogger:
         response_data: Optional[Dict[str, Any]] = None,
         error: Optional[Exception] = None
     ) -> Optional[str]:
-        """记录API调用日志."""
+        """记录API调用日志.
+
+        只将日志条目放入内存队列并立即返回文件路径，
+        实际的文件写入由后台任务完成，不阻塞请求路径。
+        """
         if not config.debug_log:
             return None
-            
+
         try:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
-            log_filename = f"{endpoint.replace('/', '_')}_{timestamp}.json"
-            log_filepath = self.log_dir / log_filename
-            
             log_data = {
                 'timestamp': datetime.now().isoformat(),
                 'endpoint': endpoint,
                 'request': request_data,
             }
-            
+
             if response_data:
                 log_data['response'] = response_data
                 log_data['status'] = 'success'
-            
+
             if error:
                 log_data['error'] = {
                     'message': str(error),
                     'type': type(error).__name__
                 }
                 log_data['status'] = 'error'
-            
-            # 写入日志文件
-            with open(log_filepath, 'w', encoding='utf-8') as f:
-                json.dump(log_data, f, indent=2, ensure_ascii=False)
-            
-            # 清理旧的日志文件
-            await self._cleanup_old_logs()
-            
-            return str(log_filepath)
-            
+
+            self._ensure_writer()
+            try:
+                self._queue.put_nowait(log_data)
+            except asyncio.QueueFull:
+                self.logger.warning("Debug log queue full, dropping entry")
+                return None
+
+            return str(self._log_path)
+
         except Exception as e:
-            self.logger.error(f"Failed to write debug log: {e}")
+            self.logger.error(f"Failed to queue debug log: {e}")
             return None
-    
-    async def _cleanup_old_logs(self):
-        """清理旧的日志文件."""
+
+    async def _write_loop(self):
+        """后台写入循环：批量取出队列条目，整批一次追加到NDJSON文件.
+
+        整批合并成单次write，open/close和写入系统调用从每条一组
+        摊薄到每批一组；文件超过log_max_bytes时按大小轮转。
+        """
+        self._cleanup_legacy_logs()
+        f = await aiofiles.open(self._log_path, 'ab')
         try:
-            log_files = list(self.log_dir.glob('*.json'))
-            
-            if len(log_files) > config.log_file_limit:
-                # 按修改时间排序，删除最旧的文件
-                log_files.sort(key=lambda f: f.stat().st_mtime)
-                files_to_remove = log_files[:-config.log_file_limit]
-                
-                for file_path in files_to_remove:
+            while True:
+                entries = [await self._queue.get()]
+                while not self._queue.empty() and len(entries) < self.BATCH_SIZE:
+                    entries.append(self._queue.get_nowait())
+
+                # orjson直接产出UTF-8字节（非ASCII不转义）；逐条序列化
+                # 以便单条坏数据不拖垮整批
+                lines = []
+                for log_data in entries:
                     try:
-                        file_path.unlink()
+                        lines.append(orjson.dumps(log_data))
                     except Exception as e:
-                        self.logger.warning(f"Failed to remove log file {file_path}: {e}")
-                        
+                        self.logger.error(f"Failed to serialize debug log: {e}")
+                    finally:
+                        self._queue.task_done()
+
+                if not lines:
+                    continue
+
+                try:
+                    await f.write(b'\n'.join(lines) + b'\n')
+                    await f.flush()
+                    if await f.tell() > config.log_max_bytes:
+                        f = await self._rotate(f)
+                except Exception as e:
+                    self.logger.error(f"Failed to write debug log: {e}")
+        finally:
+            await f.close()
+
+    async def _rotate(self, f):
+        """轮转当前NDJSON文件并返回新的追加句柄."""
+        await f.close()
+        suffix = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        try:
+            os.replace(self._log_path, self._log_path.with_name(f"debug.ndjson.{suffix}"))
+        except OSError as e:
+            self.logger.error(f"Failed to rotate debug log: {e}")
+        self._prune_rotated()
+        return await aiofiles.open(self._log_path, 'ab')
+
+    def _prune_rotated(self):
+        """删除超出log_file_limit的最旧轮转文件（时间戳后缀按字典序即时序）."""
+        try:
+            rotated = sorted(self.log_dir.glob('debug.ndjson.*'))
+            for old in rotated[:max(0, len(rotated) - config.log_file_limit)]:
+                try:
+                    old.unlink()
+                except OSError as e:
+                    self.logger.warning(f"Failed to remove log file {old}: {e}")
+        except Exception as e:
+            self.logger.error(f"Failed to prune rotated logs: {e}")
+
+    def _cleanup_legacy_logs(self):
+        """删除旧版按调用落盘的.json日志文件（仅在写入任务启动时执行一次）."""
+        try:
+            for file_path in self.log_dir.glob('*.json'):
+                try:
+                    file_path.unlink()
+                except Exception as e:
+                    self.logger.warning(f"Failed to remove log file {file_path}: {e}")
         except Exception as e:
-            self.logger.error(f"Failed to cleanup old logs: {e}")
\ No newline at end of file
+            self.logger.error(f"Failed to cleanup old logs: {e}")
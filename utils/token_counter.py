@@ -1,6 +1,8 @@
 """Token计数工具."""
 
-from typing import List, Union
+import functools
+import re
+from typing import Dict, List, Union
 
 try:
     import tiktoken
@@ -10,30 +12,98 @@ except ImportError:
 
 from models import Message
 
+# 中文字符类（预编译）：findall让整段扫描在C层完成，
+# 逐字符的Python循环在长prompt上每字符约百纳秒
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+# 编码器只构建一次：get_encoding每次都要加载并校验BPE词表，短消息的
+# 计数成本会被它完全淹没。惰性初始化（而非导入时）是因为首次构建可能
+# 需要下载词表——失败时记住失败，直接走估算回退而不是每次重试
+_ENCODING = None
+_ENCODING_FAILED = False
+
+# 精确计数结果缓存：真实负载里系统提示/模板文本会反复出现，
+# 命中时省掉整次BPE分词。超长文本不缓存（内存不划算），
+# 条目满时整体清空——比LRU簿记便宜，且重建成本只是一次批量编码
+_TOKEN_COUNT_CACHE: Dict[str, int] = {}
+_TOKEN_CACHE_MAX_ENTRIES = 1024
+_TOKEN_CACHE_MAX_TEXT_LEN = 8192
+
+
+def _cache_token_count(text: str, count: int) -> None:
+    """将单段文本的精确token数写入缓存."""
+    if len(text) > _TOKEN_CACHE_MAX_TEXT_LEN:
+        return
+    if len(_TOKEN_COUNT_CACHE) >= _TOKEN_CACHE_MAX_ENTRIES:
+        _TOKEN_COUNT_CACHE.clear()
+    _TOKEN_COUNT_CACHE[text] = count
+
+
+def _get_encoding():
+    """返回共享的cl100k_base编码器，不可用时返回None."""
+    global _ENCODING, _ENCODING_FAILED
+    if _ENCODING is None and TIKTOKEN_AVAILABLE and not _ENCODING_FAILED:
+        try:
+            _ENCODING = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _ENCODING_FAILED = True
+    return _ENCODING
+
 
 def count_tokens(messages: Union[List[Message], List[dict], str]) -> int:
     """计算消息的token数量."""
-    if TIKTOKEN_AVAILABLE:
+    encoding = _get_encoding()
+    if encoding is not None:
         try:
-            # 使用tiktoken精确计算
-            encoding = tiktoken.get_encoding("cl100k_base")
-            
+            # 使用tiktoken精确计算（共享模块级编码器）；encode_ordinary
+            # 跳过特殊token扫描，聊天内容里不会出现特殊token
             if isinstance(messages, str):
-                return len(encoding.encode(messages))
+                # 空串直接返回，省去一次Python到Rust的FFI往返
+                if not messages:
+                    return 0
+                cached = _TOKEN_COUNT_CACHE.get(messages)
+                if cached is not None:
+                    return cached
+                count = len(encoding.encode_ordinary(messages))
+                _cache_token_count(messages, count)
+                return count
             
-            total_tokens = 0
-            for message in messages:
-                if isinstance(message, Message):
-                    text = message.content
-                elif isinstance(message, dict):
-                    text = message.get('content', '')
+            if not messages:
+                return 0
+
+            # 实际调用方传入的列表元素类型总是同构的：按首元素分派到
+            # 专用列表推导，省掉热循环里每条消息的两次isinstance检查；
+            # 罕见的混合类型列表会触发异常并走下方的估算回退
+            first = messages[0]
+            if isinstance(first, Message):
+                texts = [m.content for m in messages if m.content]
+            elif isinstance(first, dict):
+                texts = [t for t in (m.get('content') for m in messages) if t]
+            else:
+                texts = [t for t in map(str, messages) if t]
+
+            if not texts:
+                return 0
+
+            # 缓存命中的文本直接取结果，未命中的仍走一次批量调用：
+            # Python到Rust的往返只有1次，BPE分词在Rust侧多线程执行并释放GIL
+            total = 0
+            misses = []
+            for text in texts:
+                cached = _TOKEN_COUNT_CACHE.get(text)
+                if cached is not None:
+                    total += cached
                 else:
-                    text = str(message)
-                
-                if text:
-                    total_tokens += len(encoding.encode(text))
-            
-            return total_tokens
+                    misses.append(text)
+
+            if misses:
+                token_lists = encoding.encode_ordinary_batch(misses, num_threads=min(8, len(misses)))
+                for text, tokens in zip(misses, token_lists):
+                    count = len(tokens)
+                    _cache_token_count(text, count)
+                    total += count
+
+            return total
             
         except Exception:
             # tiktoken失败，回退到估算
@@ -46,17 +116,19 @@ def count_tokens(messages: Union[List[Message], List[dict], str]) -> int:
     total_chars = 0
     for message in messages:
         if isinstance(message, Message):
-            total_chars += len(message.content)
+            # content可能为None（如带tool_calls的assistant消息）
+            total_chars += len(message.content or '')
         elif isinstance(message, dict):
-            total_chars += len(message.get('content', ''))
+            total_chars += len(message.get('content') or '')
         else:
             total_chars += len(str(message))
     
     return estimate_tokens_from_chars(total_chars)
 
 
+@functools.lru_cache(maxsize=1024)
 def estimate_tokens(text: str) -> int:
-    """估算文本的token数量."""
+    """估算文本的token数量（结果按文本缓存，重复提示词零扫描）."""
     # 简单的估算规则：
     # 英文: ~4字符 = 1 token
     # 中文: ~2字符 = 1 token
@@ -65,8 +137,8 @@ def estimate_tokens(text: str) -> int:
     if not text:
         return 0
     
-    # 统计中文字符
-    chinese_chars = sum(1 for char in text if '\u4e00' <= char <= '\u9fff')
+    # 统计中文字符（C层单次扫描）
+    chinese_chars = len(_CJK_RE.findall(text))
     english_chars = len(text) - chinese_chars
     
     # 根据语言特性估算